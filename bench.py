@@ -0,0 +1,493 @@
+"""Benchmarks the gamestate and audio hot paths, without display nor audio device.
+
+Usage : python bench.py [--output bench_baseline.json] [--compare old.json]
+
+openal, wx and wxasync are replaced by local stand-ins, so the numbers measure
+our own code. Results are written as JSON; with --compare, benchmarks slower
+than the given baseline by more than --threshold are reported.
+"""
+import argparse
+import asyncio
+import ctypes
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+from typing import Callable, Dict, List
+
+# ------------------------------------------------------------
+# Stand-ins for native modules
+# ------------------------------------------------------------
+
+
+def install_stubs() -> str:
+    """Registers fake openal/wx/wxasync modules. Returns the decoder in use."""
+    decoder = "simulated"
+    try:
+        import pyogg  # type: ignore
+
+        if pyogg.PYOGG_OPUS_FILE_AVAIL:
+            decoder = "pyogg"
+    except Exception:
+        pass
+
+    openal = types.ModuleType("openal")
+    openal.AL_PLAYING = 0x1012  # type: ignore
+    openal.AL_STOPPED = 0x1014  # type: ignore
+    openal.AL_FORMAT_MONO16 = 0x1101  # type: ignore
+    openal.AL_FORMAT_STEREO16 = 0x1103  # type: ignore
+    openal.PYOGG_AVAIL = True  # type: ignore
+
+    class OpusFile:
+        def __init__(self, path):
+            if decoder == "pyogg":
+                decoded = pyogg.OpusFile(path)
+                self._keep = decoded
+                self.buffer = decoded.buffer
+                self.buffer_length = decoded.buffer_length
+                self.channels = decoded.channels
+                self.frequency = decoded.frequency
+                return
+            # Roughly as much work and output as decoding a short clip
+            with open(path, "rb") as infile:
+                data = infile.read()
+            out = bytearray()
+            for i in range(0, len(data), 64):
+                out += hashlib.sha256(data[i : i + 64]).digest() * 8
+            self._keep = (ctypes.c_char * len(out)).from_buffer(out)
+            self.buffer = ctypes.addressof(self._keep)
+            self.buffer_length = len(out)
+            self.channels = 2
+            self.frequency = 48000
+
+    class Buffer:
+        def __init__(self, *args):
+            # Copy like alBufferData would
+            self.data = bytes(args[0]) if len(args) == 4 else b""
+
+        def destroy(self):
+            pass
+
+    class Source:
+        def __init__(self, *args, **kwargs):
+            self.state = openal.AL_STOPPED  # type: ignore
+
+        def set_buffer(self, buffer):
+            self.buffer = buffer
+
+        def set_gain(self, gain):
+            self.gain = gain
+
+        def play(self):
+            self.state = openal.AL_PLAYING  # type: ignore
+
+        def stop(self):
+            self.state = openal.AL_STOPPED  # type: ignore
+
+        def get_state(self):
+            # Sounds finish instantly
+            return openal.AL_STOPPED  # type: ignore
+
+        def destroy(self):
+            pass
+
+    openal.OpusFile = OpusFile  # type: ignore
+    openal.Buffer = Buffer  # type: ignore
+    openal.Source = Source  # type: ignore
+    openal.oalInit = lambda: None  # type: ignore
+    openal.oalQuit = lambda: None  # type: ignore
+    sys.modules["openal"] = openal
+
+    wx = types.ModuleType("wx")
+    wx.CallAfter = lambda f, *args, **kwargs: f(*args, **kwargs)  # type: ignore
+    sys.modules["wx"] = wx
+
+    wxasync = types.ModuleType("wxasync")
+    wxasync.StartCoroutine = lambda coro, obj: asyncio.ensure_future(  # type: ignore
+        coro() if callable(coro) else coro
+    )
+    sys.modules["wxasync"] = wxasync
+
+    return decoder
+
+
+# ------------------------------------------------------------
+# Fixtures
+# ------------------------------------------------------------
+
+
+def make_payload(kills: int = 0, deaths: int = 0, phase: str = "live") -> dict:
+    """A gamestate similar to what CS:GO posts during a match."""
+    weapons = {
+        f"weapon_{i}": {
+            "name": name,
+            "paintkit": "default",
+            "type": type,
+            "state": "active" if i == 1 else "holstered",
+            "ammo_clip": 30,
+            "ammo_clip_max": 30,
+            "ammo_reserve": 90,
+        }
+        for i, (name, type) in enumerate(
+            [
+                ("weapon_knife", "Knife"),
+                ("weapon_ak47", "Rifle"),
+                ("weapon_glock", "Pistol"),
+                ("weapon_flashbang", "Grenade"),
+                ("weapon_smokegrenade", "Grenade"),
+            ]
+        )
+    }
+    return {
+        "provider": {
+            "name": "Counter-Strike: Global Offensive",
+            "appid": 730,
+            "version": 13775,
+            "steamid": "76561198000000000",
+            "timestamp": 1600000000,
+        },
+        "map": {
+            "mode": "competitive",
+            "name": "de_dust2",
+            "phase": "live",
+            "round": 7,
+            "team_ct": {"score": 3, "timeouts_remaining": 1, "matches_won_this_series": 0},
+            "team_t": {"score": 4, "timeouts_remaining": 1, "matches_won_this_series": 0},
+            "num_matches_to_win_series": 0,
+            "current_spectators": 0,
+            "souvenirs_total": 0,
+        },
+        "round": {"phase": phase},
+        "player": {
+            "steamid": "76561198000000000",
+            "name": "player",
+            "observer_slot": 1,
+            "team": "CT",
+            "activity": "playing",
+            "match_stats": {
+                "kills": 10 + kills,
+                "assists": 2,
+                "deaths": 5 + deaths,
+                "mvps": 1,
+                "score": 25,
+            },
+            "state": {
+                "health": 100,
+                "armor": 100,
+                "helmet": True,
+                "flashed": 0,
+                "smoked": 0,
+                "burning": 0,
+                "money": 4000,
+                "round_kills": kills,
+                "round_killhs": kills // 2,
+                "equip_value": 4700,
+            },
+            "weapons": weapons,
+        },
+    }
+
+
+def make_libraryfolders(nb_libraries: int = 16) -> str:
+    lines = ['"LibraryFolders"', "{", '\t"TimeNextStatsReport"\t\t"1600000000"']
+    lines.append('\t"ContentStatsID"\t\t"-1234567890123456789"')
+    for i in range(1, nb_libraries + 1):
+        lines.append(f'\t"{i}"\t\t"D:\\\\SteamLibrary{i}"')
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def make_modern_libraryfolders(nb_libraries: int = 8, nb_apps: int = 300) -> str:
+    """libraryfolders.vdf since mid-2021 : one section per library, listing the
+    size of every app installed in it."""
+    lines = ['"libraryfolders"', "{"]
+    appid = 10
+    for i in range(nb_libraries):
+        lines.append(f'\t"{i}"')
+        lines.append("\t{")
+        for key, value in [
+            ("path", f"D:\\\\SteamLibrary{i}"),
+            ("label", ""),
+            ("contentid", str(random.getrandbits(62))),
+            ("totalsize", str(random.getrandbits(40))),
+            ("update_clean_bytes_tally", "0"),
+            ("time_last_update_corruption", "0"),
+        ]:
+            lines.append(f'\t\t"{key}"\t\t"{value}"')
+        lines.append('\t\t"apps"')
+        lines.append("\t\t{")
+        for _ in range(nb_apps):
+            appid = appid + 10
+            lines.append(f'\t\t\t"{appid}"\t\t"{random.getrandbits(34)}"')
+        lines.append("\t\t}")
+        lines.append("\t}")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def make_appmanifest(nb_depots: int = 40) -> str:
+    lines = ['"AppState"', "{"]
+    for key, value in [
+        ("appid", "730"),
+        ("Universe", "1"),
+        ("name", "Counter-Strike: Global Offensive"),
+        ("StateFlags", "4"),
+        ("installdir", "Counter-Strike Global Offensive"),
+        ("LastUpdated", "1600000000"),
+        ("UpdateResult", "0"),
+        ("SizeOnDisk", "27310470231"),
+        ("buildid", "5900000"),
+    ]:
+        lines.append(f'\t"{key}"\t\t"{value}"')
+    for section in ("InstalledDepots", "SharedDepots"):
+        lines.append(f'\t"{section}"')
+        lines.append("\t{")
+        for depot in range(nb_depots):
+            lines.append(f'\t\t"{731 + depot}"')
+            lines.append("\t\t{")
+            lines.append(f'\t\t\t"manifest"\t\t"{random.getrandbits(62)}"')
+            lines.append(f'\t\t\t"size"\t\t"{random.getrandbits(32)}"')
+            lines.append("\t\t}")
+        lines.append("\t}")
+    lines.append('\t"UserConfig"')
+    lines.append("\t{")
+    lines.append('\t\t"language"\t\t"english"')
+    lines.append("\t}")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+# ------------------------------------------------------------
+# Measurements
+# ------------------------------------------------------------
+
+
+def measure(func: Callable, min_time: float = 0.5, repeat: int = 5) -> Dict:
+    """Times func, returning per-call statistics in microseconds."""
+    # Calibrate the number of calls per sample
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or number >= 1 << 20:
+            break
+        number *= 2
+
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    samples.sort()
+    return {
+        "min_us": samples[0] * 1e6,
+        "median_us": samples[len(samples) // 2] * 1e6,
+        "ops_per_s": 1.0 / samples[len(samples) // 2] if samples[0] > 0 else 0.0,
+        "calls": number * repeat,
+    }
+
+
+class Sounds:
+    """Stands in for SoundManager in the gamestate benchmarks."""
+
+    def play(self, sound_name: str) -> bool:
+        return True
+
+    def post(self, sound_names, received=None) -> None:
+        self.play(sound_names[0])
+
+    def prefetch(self, sound_name: str) -> None:
+        pass
+
+
+def bench_player_state() -> Dict[str, Dict]:
+    from gsi import decode
+    from state import PlayerState
+
+    sounds = Sounds()
+    payloads = [make_payload(kills=i % 5, deaths=i // 5) for i in range(10)]
+    states = [PlayerState(decode(payload), sounds) for payload in payloads]
+
+    def build():
+        # From the parsed payload, as before gsi.decode() existed
+        for payload in payloads:
+            PlayerState(decode(payload), sounds)
+
+    def decode_only():
+        for payload in payloads:
+            decode(payload)
+
+    def compare():
+        old = states[0]
+        for state in states[1:]:
+            state.compare(old)
+            old = state
+
+    results = {
+        "player_state_build": measure(build),
+        "gamestate_decode": measure(decode_only),
+        "player_state_compare": measure(compare),
+    }
+    for result in results.values():
+        result["per_update_us"] = result["median_us"] / len(payloads)
+    return results
+
+
+def bench_steamfiles() -> Dict[str, Dict]:
+    import steamfiles
+
+    libraryfolders = make_libraryfolders()
+    modern_libraryfolders = make_modern_libraryfolders()
+    appmanifest = make_appmanifest()
+    return {
+        "steamfiles_libraryfolders": measure(lambda: steamfiles.loads(libraryfolders)),
+        "steamfiles_libraryfolders_modern": measure(
+            lambda: steamfiles.loads(modern_libraryfolders)
+        ),
+        "steamfiles_appmanifest": measure(lambda: steamfiles.loads(appmanifest)),
+        "steamfiles_appmanifest_get": measure(
+            lambda: steamfiles.get(appmanifest, "AppState", "installdir")
+        ),
+    }
+
+
+class Client:
+    def __init__(self) -> None:
+        self.gui = None
+
+    def status(self, text: str) -> None:
+        pass
+
+
+async def bench_sounds_async() -> Dict[str, Dict]:
+    import library
+    import soundbank
+    import sounds
+    from soundcache import PCMCache
+
+    results: Dict[str, Dict] = {}
+    cache_dir = tempfile.mkdtemp(prefix="csgo-sounds-bench-")
+    try:
+        nb_files = len(library.scan())
+        bank_file = os.path.join(cache_dir, soundbank.BANK_FILE)
+        for name in ("sound_reload_cold", "sound_reload_warm", "sound_reload_bank"):
+            manager = sounds.SoundManager(Client())
+            manager.cache = PCMCache(cache_dir)
+            manager.bank = None
+            if name == "sound_reload_bank":
+                # Stand-ins are not available to worker processes
+                soundbank.build(output=bank_file, workers=1)
+                manager.cache = PCMCache(os.path.join(cache_dir, "empty"))
+                manager.bank = soundbank.SoundBank(bank_file)
+            start = time.perf_counter()
+            await manager.reload()
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                "total_ms": elapsed * 1e3,
+                "files": nb_files,
+                "files_per_s": nb_files / elapsed if elapsed > 0 else 0.0,
+            }
+            manager.watcher.cancel()
+            manager.decoder.shutdown()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    categories = [c for c, buffers in manager.loaded_sounds.items() if buffers]
+
+    def play():
+        # Stand-in sources stop right away : collect them after each play, so the
+        # pool never runs out and this measures playing, not the failure path.
+        for category in categories:
+            manager.play(category)
+            manager.voices.collect()
+
+    results["sound_play"] = measure(play)
+    results["sound_play"]["per_play_us"] = results["sound_play"]["median_us"] / max(
+        len(categories), 1
+    )
+    return results
+
+
+def bench_sounds() -> Dict[str, Dict]:
+    return asyncio.run(bench_sounds_async())
+
+
+BENCHMARKS = {
+    "player_state": bench_player_state,
+    "steamfiles": bench_steamfiles,
+    "sounds": bench_sounds,
+}
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float):
+    """Prints benchmarks that got slower than the baseline. Returns their count."""
+    regressions = 0
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for key in ("median_us", "total_ms"):
+            if key in result and key in old and old[key] > 0:
+                ratio = result[key] / old[key]
+                marker = "  REGRESSION" if ratio > 1 + threshold else ""
+                print(
+                    f"{name:30} {key:10} {old[key]:12.2f} -> {result[key]:12.2f}"
+                    f" ({ratio:5.2f}x){marker}"
+                )
+                if marker:
+                    regressions = regressions + 1
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="bench_baseline.json")
+    parser.add_argument("--compare", help="baseline to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--only", choices=sorted(BENCHMARKS), action="append")
+    args = parser.parse_args()
+
+    # Benchmarks use the bundled sounds/ and config.ini
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    random.seed(0)
+    decoder = install_stubs()
+
+    results: Dict[str, Dict] = {}
+    for name in args.only or BENCHMARKS:
+        print(f"[*] Running {name} benchmarks...")
+        results.update(BENCHMARKS[name]())
+
+    for name, result in results.items():
+        print(f"{name:30} " + ", ".join(f"{k}={v:.2f}" for k, v in result.items()))
+
+    with open(args.output, "w") as outfile:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "decoder": decoder,
+                "results": results,
+            },
+            outfile,
+            indent=2,
+        )
+    print(f"[*] Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as infile:
+            baseline = json.load(infile)
+        if compare(results, baseline["results"], args.threshold) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
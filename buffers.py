@@ -0,0 +1,133 @@
+"""OpenAL buffers of the loaded sounds, within a memory budget"""
+from collections import OrderedDict
+from openal import Buffer  # type: ignore
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+
+def destroy(buffers: Iterable[Optional[Buffer]]) -> None:
+    for buffer in buffers:
+        if buffer is None:
+            continue
+        try:
+            buffer.destroy()
+        except:  # noqa
+            # Buffer is still playing, let the OS clean it up
+            pass
+
+
+class BufferCache:
+    """Buffers by file path, evicted least recently played first when they take
+    more than budget bytes (0 means no budget).
+
+    Every category keeps one pinned variant that is never evicted, so it can
+    always play something right away. Buffers that are playing aren't evicted
+    either.
+    """
+
+    def __init__(
+        self, budget: int = 0, in_use: Callable[[Buffer], bool] = lambda b: False
+    ) -> None:
+        self.budget = budget
+        self.in_use = in_use
+        self.lock = Lock()
+        # OrderedDict[filepath:(buffer, size)], least recently used first
+        self.resident: OrderedDict = OrderedDict()
+        # Dict[filepath:size] of every loaded file, resident or evicted
+        self.loaded: Dict[str, int] = {}
+        # Dict[category:filepath]
+        self.pinned: Dict[str, str] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, filepath: str) -> bool:
+        """True if the file has a buffer right now."""
+        return filepath in self.resident
+
+    def get(self, filepath: str) -> Optional[Buffer]:
+        """Returns the buffer of a file, or None if it was evicted."""
+        with self.lock:
+            entry = self.resident.get(filepath)
+            if entry is None:
+                self.misses = self.misses + 1
+                return None
+            self.hits = self.hits + 1
+            self.resident.move_to_end(filepath)
+            return entry[0]
+
+    def put(self, filepath: str, buffer: Buffer, size: int) -> Optional[Buffer]:
+        """Adds a buffer. Returns the buffer it replaces, if any."""
+        with self.lock:
+            old = self.resident.pop(filepath, None)
+            if old is not None:
+                self.bytes = self.bytes - old[1]
+            self.resident[filepath] = (buffer, size)
+            self.loaded[filepath] = size
+            self.bytes = self.bytes + size
+        return old[0] if old is not None else None
+
+    def pop(self, filepath: str) -> Optional[Buffer]:
+        """Forgets a file. Returns its buffer, if it had one."""
+        with self.lock:
+            self.loaded.pop(filepath, None)
+            for category, pinned in list(self.pinned.items()):
+                if pinned == filepath:
+                    del self.pinned[category]
+            old = self.resident.pop(filepath, None)
+            if old is None:
+                return None
+            self.bytes = self.bytes - old[1]
+            return old[0]
+
+    def pin(self, category: str, filepaths: Sequence[str]) -> None:
+        """Keeps one of the files of a category resident, preferably the one
+        already pinned."""
+        with self.lock:
+            if self.pinned.get(category) in filepaths:
+                if self.pinned[category] in self.resident:
+                    return
+            for filepath in filepaths:
+                if filepath in self.resident:
+                    self.pinned[category] = filepath
+                    return
+            self.pinned.pop(category, None)
+
+    def hot(self, category: str) -> Optional[Buffer]:
+        """Returns the pinned buffer of a category."""
+        with self.lock:
+            entry = self.resident.get(self.pinned.get(category, ""))
+        return entry[0] if entry is not None else None
+
+    def trim(self) -> None:
+        """Evicts buffers until they fit in the budget."""
+        if self.budget <= 0 or self.bytes <= self.budget:
+            return
+        evicted: List[Buffer] = []
+        with self.lock:
+            pinned = set(self.pinned.values())
+            for filepath, (buffer, size) in list(self.resident.items()):
+                if self.bytes <= self.budget:
+                    break
+                if filepath in pinned or self.in_use(buffer):
+                    continue
+                del self.resident[filepath]
+                self.bytes = self.bytes - size
+                self.evictions = self.evictions + 1
+                evicted.append(buffer)
+        destroy(evicted)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "budget_bytes": self.budget,
+                "resident_bytes": self.bytes,
+                "loaded_bytes": sum(self.loaded.values()),
+                "resident": len(self.resident),
+                "loaded": len(self.loaded),
+                "pinned": len(self.pinned),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
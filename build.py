@@ -1,12 +1,17 @@
+import subprocess
 import sys
 from cx_Freeze import setup, Executable  # type: ignore
 from typing import Dict
 
+# Decode every sound ahead of time, so the frozen app only has to map the bank
+subprocess.check_call([sys.executable, "soundbank.py"])
+
 buildOptions: Dict = dict(
     packages=["aiofiles", "pyogg", "openal", "wx", "wxasync"],
     excludes=["tkinter"],
     include_files=[
         "sounds",
+        "sounds.bank",
         "gamestate_integration_ccs.cfg",
         "icon.ico",
         "config.ini",
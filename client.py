@@ -1,28 +1,43 @@
+import asyncio
+
+import config
 from sounds import SoundManager
 from state import CSGOState
+from status import ConsoleStatus, StatusScheduler
+from timeline import startup
 
 
 class Client:
-    def __init__(self, gui) -> None:
+    def __init__(self, gui=None, status=None) -> None:
+        """Runs sounds and gamestate tracking.
+
+        gui is the MainFrame, or None when running headless.
+        status shows status messages, from the event loop. Messages sent with
+        self.status() from any thread are coalesced before reaching it.
+        """
         self.gui = gui
+        self.status = StatusScheduler(status if status is not None else ConsoleStatus())
         self.sounds = SoundManager(self)
         self.state = CSGOState(self)
+        # Picks up edits made to config.ini while running
+        self.settings_watcher = asyncio.ensure_future(config.settings.watch())
 
-    async def update_status(self) -> None:
-        with self.state.lock:
-            if self.state.old_state is None:
-                self.gui.SetStatusText("Waiting for CS:GO...")
-            elif self.state.old_state.is_ingame:
-                phase = self.state.old_state.phase
-                if phase == "unknown":
-                    phase = ""
-                else:
-                    phase = " (%s)" % phase
-                self.gui.SetStatusText(
-                    f"Round {self.state.old_state.current_round}{phase}"
-                )
+    def state_text(self) -> str:
+        state = self.state.old_state
+        if state is None:
+            return "Waiting for CS:GO..."
+        elif state.is_ingame:
+            phase = state.phase
+            if phase == "unknown":
+                phase = ""
             else:
-                self.gui.SetStatusText("Not in a match.")
+                phase = " (%s)" % phase
+            return f"Round {state.current_round}{phase}"
+        else:
+            return "Not in a match."
+
+    async def update_status(self) -> None:
+        self.status(self.state_text())
 
     async def reload_sounds(self) -> None:
         """Reloads all sounds.
@@ -30,6 +45,10 @@ class Client:
         Do not call outside of gui, unless you disable the update sounds button first.
         """
         await self.sounds.reload()
-        await self.update_status()
-        self.gui.updateSoundsBtn.Enable()
+        startup.mark("sounds loaded")
+        startup.report()
+        # In one message : the scheduler only shows the latest one
+        self.status(f"{self.sounds.loaded_text()} {self.state_text()}")
+        if self.gui is not None:
+            self.gui.updateSoundsBtn.Enable()
         self.sounds.play("Round start")
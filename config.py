@@ -1,14 +1,190 @@
+"""Settings, stored in config.ini"""
+import asyncio
+import atexit
 import configparser
+import os
+from threading import Lock, Timer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+CONFIG_FILE = "config.ini"
+# Writes are delayed by this many seconds, so that dragging the volume slider
+# writes the file once.
+SAVE_DELAY = 1.0
 
 config = configparser.ConfigParser()
-config.read("config.ini")
+config.read(CONFIG_FILE)
+
+
+class Settings:
+    """Typed settings, read as plain attributes.
+
+    Changes made with set() notify subscribers and are written to config.ini
+    shortly after, from a timer thread. watch() picks up changes made to
+    config.ini outside of the app.
+    """
+
+    # Dict[attribute:(section, option, type, default)]
+    FIELDS: Dict[str, Tuple[str, str, type, Any]] = {
+        "prefer_headshots": ("Sounds", "PreferHeadshots", bool, False),
+        "volume": ("Sounds", "Volume", int, 50),
+        "max_voices": ("Sounds", "MaxVoices", int, 8),
+        "lazy_loading": ("Sounds", "LazyLoading", bool, False),
+        "event_policy": ("Sounds", "EventPolicy", str, "highest"),
+        "stale_event_ms": ("Sounds", "StaleEventMs", float, 1000.0),
+        "max_backlog": ("Sounds", "MaxBacklog", int, 8),
+        "buffer_budget_mb": ("Sounds", "BufferBudgetMB", float, 0.0),
+        "server_host": ("Server", "Host", str, "127.0.0.1"),
+        "server_port": ("Server", "Port", int, 3000),
+        # Sent by the game in every gamestate, generated on first run
+        "auth_token": ("Server", "AuthToken", str, ""),
+        "feeds_listen": ("Feeds", "Listen", str, ""),
+        "record_path": ("Debug", "RecordPath", str, ""),
+        "latency_status": ("Debug", "LatencyStatus", bool, False),
+        "profile_dir": ("Debug", "ProfileDir", str, "profiles"),
+        "profile_seconds": ("Debug", "ProfileSeconds", float, 30.0),
+    }
+    # Fields only read at startup
+    RESTART = ("max_voices", "lazy_loading", "server_host", "server_port", "record_path")
+
+    def __init__(self, parser: configparser.ConfigParser, path: str) -> None:
+        self.parser = parser
+        self.path = path
+        self.lock = Lock()
+        self.timer: Optional[Timer] = None
+        # Dict[attribute:List[callback(value)]]
+        self.subscribers: Dict[str, List[Callable[[Any], None]]] = {}
+        # (mtime, size) of config.ini when we last read or wrote it
+        self.stamp = self.file_stamp()
+        for name, value in self.parse().items():
+            setattr(self, name, value)
+
+    # Attributes, set from FIELDS
+    prefer_headshots: bool
+    volume: int
+    max_voices: int
+    lazy_loading: bool
+    event_policy: str
+    stale_event_ms: float
+    max_backlog: int
+    buffer_budget_mb: float
+    server_host: str
+    server_port: int
+    auth_token: str
+    feeds_listen: str
+    record_path: str
+    latency_status: bool
+    profile_dir: str
+    profile_seconds: float
+
+    def file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def parse(self) -> Dict[str, Any]:
+        """Returns the typed value of every field, from the parser."""
+        values = {}
+        for name, (section, option, kind, default) in self.FIELDS.items():
+            try:
+                if kind is bool:
+                    value = self.parser.getboolean(section, option, fallback=default)
+                elif kind is int:
+                    value = self.parser.getint(section, option, fallback=default)
+                elif kind is float:
+                    value = self.parser.getfloat(section, option, fallback=default)
+                else:
+                    value = self.parser.get(section, option, fallback=default)
+            except ValueError:
+                print(f"[!] Invalid value for {option} in {self.path}, using {default}")
+                value = default
+            values[name] = value
+        return values
+
+    def subscribe(self, name: str, callback: Callable[[Any], None]) -> None:
+        """Calls callback(value) whenever the setting changes, from the thread
+        that changed it."""
+        self.subscribers.setdefault(name, []).append(callback)
+
+    def notify(self, name: str, value: Any) -> None:
+        for callback in self.subscribers.get(name, []):
+            callback(value)
+
+    def set(self, name: str, value: Any) -> None:
+        """Changes a setting, and schedules writing config.ini."""
+        section, option, kind, _ = self.FIELDS[name]
+        value = kind(value)
+        if value == getattr(self, name):
+            return
+        setattr(self, name, value)
+        with self.lock:
+            if not self.parser.has_section(section):
+                self.parser.add_section(section)
+            self.parser.set(section, option, str(value))
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = Timer(SAVE_DELAY, self.save)
+            self.timer.daemon = True
+            self.timer.start()
+        self.notify(name, value)
+
+    def save(self) -> None:
+        """Writes config.ini atomically."""
+        with self.lock:
+            self.timer = None
+            try:
+                with open(self.path + ".tmp", "w") as outfile:
+                    self.parser.write(outfile, space_around_delimiters=True)
+                os.replace(self.path + ".tmp", self.path)
+            except OSError as err:
+                print(f"[!] Could not save settings : {err}")
+            # Don't reload our own changes
+            self.stamp = self.file_stamp()
+
+    def flush(self) -> None:
+        """Writes pending changes now."""
+        with self.lock:
+            timer = self.timer
+            if timer is None:
+                return
+            timer.cancel()
+        self.save()
+
+    def reload(self) -> None:
+        """Reads config.ini again if it changed, and notifies what changed."""
+        stamp = self.file_stamp()
+        with self.lock:
+            if stamp == self.stamp or self.timer is not None:
+                # Unchanged, or about to be overwritten with our own changes
+                return
+            # Even if it doesn't parse, so errors are reported once per edit
+            self.stamp = stamp
+            parser = configparser.ConfigParser()
+            try:
+                parser.read(self.path)
+            except configparser.Error as err:
+                print(f"[!] Could not reload {self.path} : {err}")
+                return
+            # In place, config.config is the same parser
+            self.parser.clear()
+            self.parser.read_dict(parser)
 
+        print(f"[*] Reloaded {self.path}")
+        for name, value in self.parse().items():
+            if value != getattr(self, name):
+                setattr(self, name, value)
+                self.notify(name, value)
+                if name in self.RESTART:
+                    option = self.FIELDS[name][1]
+                    print(f"[*] {option} changed, restart to apply it")
 
-def saveCfg():
-    with open("config.ini", "w") as outfile:
-        config.write(outfile, space_around_delimiters=True)
+    async def watch(self, interval: float = 2.0) -> None:
+        """Reloads config.ini whenever it changes."""
+        while True:
+            await asyncio.sleep(interval)
+            self.reload()
 
 
-def set(section, option, val):
-    config.set(section, option, str(val))
-    saveCfg()
+settings = Settings(config, CONFIG_FILE)
+atexit.register(settings.flush)
@@ -0,0 +1,222 @@
+"""Decodes opus files in worker processes, one per available core.
+
+Decoding is mostly Python and ctypes work in pyogg, so threads barely run in
+parallel. Workers write their samples into an arena allocated by the caller,
+sized from each file's last Ogg granule position : a temporary file that the
+caller and the workers map in memory. Samples that do not fit are sent back
+pickled instead.
+"""
+import asyncio
+import ctypes
+import mmap
+import os
+import struct
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from openal import OpusFile  # type: ignore
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from soundcache import PCM, decode
+
+# Opus is always decoded at 48kHz, 16-bit samples
+BYTES_PER_SAMPLE = 2
+# An Ogg page is at most ~64KiB, so the last page header is in there
+TAIL_SIZE = 65536 + 27
+
+
+def cores() -> int:
+    """Cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))  # type: ignore
+    except AttributeError:  # windows, macOS
+        return os.cpu_count() or 1
+
+
+def decoded_size(filepath: str) -> int:
+    """Returns an upper bound of the decoded size of an opus file, or 0."""
+    try:
+        with open(filepath, "rb") as infile:
+            head = infile.read(512)
+            infile.seek(0, os.SEEK_END)
+            infile.seek(max(infile.tell() - TAIL_SIZE, 0))
+            tail = infile.read()
+    except OSError:
+        return 0
+
+    opus_head = head.find(b"OpusHead")
+    last_page = tail.rfind(b"OggS")
+    if opus_head < 0 or last_page < 0 or len(tail) < last_page + 14:
+        return 0
+    channels = head[opus_head + 9] if len(head) > opus_head + 9 else 0
+    # Includes the pre-skip, hence an upper bound
+    (granule,) = struct.unpack_from("<q", tail, last_page + 6)
+    return max(granule, 0) * channels * BYTES_PER_SAMPLE
+
+
+class Arena:
+    """Temporary file mapped in memory, that worker processes open by its path.
+
+    Unlike multiprocessing.shared_memory, this works on Python 3.7.
+    """
+
+    def __init__(self, size: int) -> None:
+        fd, self.path = tempfile.mkstemp(prefix="csgo-sounds-", suffix=".arena")
+        try:
+            os.ftruncate(fd, size)
+            self.buf = mmap.mmap(fd, size)
+        except BaseException:
+            os.close(fd)
+            self.unlink()
+            raise
+        os.close(fd)
+
+    def close(self) -> None:
+        self.buf.close()
+
+    def unlink(self) -> None:
+        try:
+            os.remove(self.path)
+        except OSError:
+            # On windows, while something still maps it
+            pass
+
+
+class Decoded(NamedTuple):
+    length: int
+    channels: int
+    frequency: int
+    # None when the samples were written to the arena
+    data: Optional[bytes]
+
+
+def decode_into(
+    filepath: str, arena: Optional[str], offset: int, capacity: int
+) -> Decoded:
+    """Runs in a worker process."""
+    file = OpusFile(filepath)
+    length = file.buffer_length
+    if arena is None or length > capacity:
+        data = ctypes.string_at(file.buffer, length)
+        return Decoded(length, file.channels, file.frequency, data)
+
+    with open(arena, "r+b") as outfile, mmap.mmap(outfile.fileno(), 0) as buf:
+        view = (ctypes.c_char * length).from_buffer(buf, offset)
+        ctypes.memmove(view, file.buffer, length)
+        # The view must be gone before the mapping can be closed
+        del view
+    return Decoded(length, file.channels, file.frequency, None)
+
+
+class Batch:
+    """Samples decoded by DecodeEngine.decode().
+
+    pcms may point into the arena : close() the batch once they are copied
+    to OpenAL buffers and to the cache. Files that could not be decoded are
+    reported and left out.
+    """
+
+    def __init__(self, arena: Optional[Arena] = None) -> None:
+        self.arena = arena
+        # Dict[filepath:PCM]
+        self.pcms: Dict[str, PCM] = {}
+        self.failed: List[str] = []
+
+    def fail(self, filepath: str, err: Exception) -> None:
+        print(f"[!] Could not decode {filepath} : {err}")
+        self.failed.append(filepath)
+
+    def close(self) -> None:
+        self.pcms = {}
+        if self.arena is None:
+            return
+        try:
+            self.arena.close()
+        except BufferError:
+            # Something kept a view on the samples, the mapping goes when it does
+            pass
+        self.arena.unlink()
+        self.arena = None
+
+
+class DecodeEngine:
+    """Process pool decoding opus files, started on first use."""
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.workers = workers or cores()
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    async def decode(self, filepaths: Sequence[str], on_decoded=None) -> Batch:
+        """Decodes files in parallel, in no particular order.
+
+        on_decoded is called on the event loop after each file.
+        """
+        loop = asyncio.get_running_loop()
+        batch = Batch()
+        if self.workers < 2 or (len(filepaths) == 1 and self.executor is None):
+            # Worker processes would only add overhead : single core, or a single
+            # file was edited.
+            async def decode_here(filepath: str) -> None:
+                try:
+                    batch.pcms[filepath] = await loop.run_in_executor(
+                        None, decode, filepath
+                    )
+                except Exception as err:
+                    batch.fail(filepath, err)
+                if on_decoded is not None:
+                    on_decoded(filepath)
+
+            await asyncio.gather(*[decode_here(filepath) for filepath in filepaths])
+            return batch
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        sizes = await loop.run_in_executor(
+            None, lambda: [decoded_size(filepath) for filepath in filepaths]
+        )
+        offsets: List[int] = []
+        total = 0
+        for size in sizes:
+            offsets.append(total)
+            total = total + size
+
+        if total > 0:
+            try:
+                batch.arena = Arena(total)
+            except OSError as err:
+                print(f"[!] Could not allocate memory for decoding : {err}")
+        arena = batch.arena.path if batch.arena is not None else None
+
+        async def decode_one(filepath: str, offset: int, size: int) -> None:
+            try:
+                decoded = await loop.run_in_executor(
+                    self.executor, decode_into, filepath, arena, offset, size
+                )
+            except Exception as err:
+                batch.fail(filepath, err)
+            else:
+                if decoded.data is not None:
+                    data = decoded.data
+                else:
+                    data = (ctypes.c_char * decoded.length).from_buffer(
+                        batch.arena.buf, offset
+                    )
+                batch.pcms[filepath] = PCM(data, decoded.channels, decoded.frequency)
+            if on_decoded is not None:
+                on_decoded(filepath)
+
+        try:
+            await asyncio.gather(
+                *[
+                    decode_one(filepath, offset, size)
+                    for filepath, offset, size in zip(filepaths, offsets, sizes)
+                ]
+            )
+        except BaseException:
+            batch.close()
+            raise
+        return batch
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
@@ -0,0 +1,150 @@
+"""Event pipeline between gamestate detection and sound playback"""
+import heapq
+import itertools
+import queue
+import time
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+from metrics import metrics
+
+# Every event of an update window plays at once, overlapping (legacy behavior)
+OVERLAP = "overlap"
+# Only the most important event of an update window plays
+HIGHEST = "highest"
+# Events play one after the other, most important first
+QUEUE = "queue"
+POLICIES = (OVERLAP, HIGHEST, QUEUE)
+
+
+class Event(NamedTuple):
+    # Categories to try in order, the first one with sounds gets played
+    sound_names: Tuple[str, ...]
+    priority: int
+    timestamp: float
+    # When the gamestate update that caused it was received, if known
+    received: Optional[float] = None
+
+
+class EventPipeline:
+    """Collects events from any thread, coalesces them and hands them to play().
+
+    Events posted before the event loop gets to drain them form an update window.
+    The backlog is bounded : when full, the least important event is dropped.
+    Events older than stale_ms when their turn comes are dropped too. With the
+    QUEUE policy, waiting for the sounds before them doesn't count : an event's
+    age starts when it could first have played. Drops are counted in /metrics.
+    """
+
+    def __init__(
+        self,
+        loop,
+        play: Callable[[str], bool],
+        priority: Callable[[str], int],
+        idle: Callable[[], bool],
+        policy: str = HIGHEST,
+        stale_ms: float = 0,
+        max_backlog: int = 8,
+    ) -> None:
+        self.loop = loop
+        self.play = play
+        self.priority = priority
+        # Returns True when no sound is playing, for the QUEUE policy
+        self.idle = idle
+
+        self.events: queue.SimpleQueue = queue.SimpleQueue()
+        self.drain_scheduled = False
+        # Heap of (-priority, sequence, event)
+        self.backlog: List[Tuple[int, int, Event]] = []
+        self.sequence = itertools.count()
+        # When the QUEUE policy last found no sound playing after waiting for one
+        self.playable_since = 0.0
+        self.waiting = False
+        # Called after an event started playing, if set
+        self.on_played: Optional[Callable[[], None]] = None
+        self.set_policy(policy)
+        self.set_limits(stale_ms, max_backlog)
+
+    def set_policy(self, policy: str) -> None:
+        if policy not in POLICIES:
+            print(f"[!] Unknown event policy '{policy}', using '{HIGHEST}'.")
+            policy = HIGHEST
+        self.policy = policy
+
+    def set_limits(self, stale_ms: float, max_backlog: int) -> None:
+        self.stale = stale_ms / 1000.0
+        self.max_backlog = max(max_backlog, 1)
+        while len(self.backlog) > self.max_backlog:
+            self.backlog.remove(max(self.backlog))
+            metrics.count("events over backlog")
+        heapq.heapify(self.backlog)
+
+    def post(self, sound_names: Sequence[str], received: Optional[float] = None) -> None:
+        """Queues an event. Safe to call from any thread."""
+        sound_names = tuple(sound_names)
+        if not sound_names:
+            return
+        self.events.put(
+            Event(
+                sound_names, self.priority(sound_names[0]), time.monotonic(), received
+            )
+        )
+        if not self.drain_scheduled:
+            self.drain_scheduled = True
+            self.loop.call_soon_threadsafe(self.drain)
+
+    def drain(self) -> None:
+        """Moves the current update window to the backlog, then dispatches."""
+        # Reset first, so events posted while draining schedule another drain
+        self.drain_scheduled = False
+        window: List[Event] = []
+        while True:
+            try:
+                window.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+
+        if self.policy == HIGHEST and len(window) > 1:
+            best = max(window, key=lambda event: event.priority)
+            metrics.count("events coalesced", len(window) - 1)
+            window = [best]
+        for event in window:
+            self.push(event)
+
+        self.dispatch()
+
+    def push(self, event: Event) -> None:
+        heapq.heappush(self.backlog, (-event.priority, next(self.sequence), event))
+        if len(self.backlog) > self.max_backlog:
+            # Least important, and newest among those
+            self.backlog.remove(max(self.backlog))
+            heapq.heapify(self.backlog)
+            metrics.count("events over backlog")
+
+    def dispatch(self) -> None:
+        """Plays backlogged events, as the policy allows."""
+        now = time.monotonic()
+        while self.backlog:
+            if self.policy == QUEUE:
+                if not self.idle():
+                    # Called again when the current sound ends
+                    self.waiting = True
+                    return
+                if self.waiting:
+                    self.waiting = False
+                    self.playable_since = now
+            _, _, event = heapq.heappop(self.backlog)
+            playable = max(event.timestamp, self.playable_since)
+            if self.stale > 0 and now - playable > self.stale:
+                metrics.count("events stale")
+                continue
+            metrics.record("queue", now - event.timestamp)
+            for sound_name in event.sound_names:
+                started = time.monotonic()
+                if self.play(sound_name):
+                    playing = time.monotonic()
+                    metrics.record("play", playing - started)
+                    if event.received is not None:
+                        metrics.record_sound(sound_name, playing - event.received)
+                    if self.on_played is not None:
+                        self.on_played()
+                    break
@@ -0,0 +1,226 @@
+"""Schema of the gamestate integration payloads, as far as this app reads them"""
+import json
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    # Optional, parses payloads several times faster than json
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+
+class SchemaError(ValueError):
+    """A payload is missing a field we need, or has one of the wrong type."""
+
+    def __init__(self, path: Tuple[str, ...], message: str) -> None:
+        super().__init__(f"{'.'.join(path)} {message}" if path else message)
+        self.path = path
+
+
+def loads(body: bytes) -> Any:
+    """Parses a payload. Raises ValueError if it isn't JSON."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+# (attribute, path, type) of the fields every in-game payload must have
+REQUIRED = (
+    ("current_round", ("map", "round"), int),
+    ("ct_timeouts", ("map", "team_ct", "timeouts_remaining"), int),
+    ("t_timeouts", ("map", "team_t", "timeouts_remaining"), int),
+    ("flashed", ("player", "state", "flashed"), int),
+    ("round_kills", ("player", "state", "round_kills"), int),
+    ("round_killhs", ("player", "state", "round_killhs"), int),
+    ("mvps", ("player", "match_stats", "mvps"), int),
+    ("kills", ("player", "match_stats", "kills"), int),
+    ("deaths", ("player", "match_stats", "deaths"), int),
+)
+# (attribute, path, type, default) of the fields that may be missing
+OPTIONAL = (
+    # No round section during warmup
+    ("phase", ("round", "phase"), str, "unknown"),
+    # Only at round end
+    ("win_team", ("round", "win_team"), str, None),
+    # Not before the player joins a team
+    ("team", ("player", "team"), str, None),
+)
+
+
+_MISSING = object()
+# Default of optional parents, never modified
+_EMPTY: Dict[str, Any] = {}
+
+
+def _group(fields) -> List[Tuple[Tuple[str, ...], list]]:
+    """Groups (attribute, path, type, default) fields by the object holding them,
+    so each object is only looked up once."""
+    groups: Dict[Tuple[str, ...], list] = {}
+    for attribute, path, kind, default in fields:
+        groups.setdefault(path[:-1], []).append((attribute, path, kind, default))
+    return list(groups.items())
+
+
+# Required fields have no default
+_HEADER = _group(
+    [
+        ("steamid", ("provider", "steamid"), str, _MISSING),
+        ("playerid", ("player", "steamid"), str, _MISSING),
+    ]
+)
+_GROUPS = _group(
+    [(attribute, path, kind, _MISSING) for attribute, path, kind in REQUIRED]
+    + list(OPTIONAL)
+)
+
+
+def _active_weapon(player: dict) -> Optional[Tuple[Any, Any]]:
+    """Returns the (name, type) of the weapon in hand, if any."""
+    weapons = player.get("weapons")
+    if isinstance(weapons, dict):
+        for weapon in weapons.values():
+            if isinstance(weapon, dict) and weapon.get("state") == "active":
+                return weapon.get("name"), weapon.get("type")
+    return None
+
+
+def _object(payload: dict, path: Tuple[str, ...]) -> Optional[dict]:
+    """Returns the object at path, or None if it is missing."""
+    value: Any = payload
+    for i, key in enumerate(path):
+        value = value.get(key)
+        if value is None:
+            return None
+        if type(value) is not dict:
+            raise SchemaError(path[: i + 1], "is not an object")
+    return value
+
+
+def _check(path: Tuple[str, ...], kind: type, value: Any, default: Any) -> Any:
+    """Slow path of decode(), for values that are missing or not of their type."""
+    if value is _MISSING or value is None:
+        if default is _MISSING:
+            raise SchemaError(path, "is missing")
+        return default
+    raise SchemaError(path, f"should be {kind.__name__}, not {type(value).__name__}")
+
+
+def _fill(gamestate: Any, payload: dict, groups) -> None:
+    for parent_path, fields in groups:
+        parent = _object(payload, parent_path)
+        for attribute, path, kind, default in fields:
+            value = parent.get(path[-1], _MISSING) if parent is not None else _MISSING
+            # Exact type : bool is an int, but never a valid one here
+            if type(value) is not kind:
+                value = _check(path, kind, value, default)
+            setattr(gamestate, attribute, value)
+
+
+class Gamestate:
+    """The fields of a payload this app reads, typed."""
+
+    __slots__ = (
+        ("steamid", "playerid", "in_menu", "knife_active")
+        + tuple(attribute for attribute, _, _ in REQUIRED)
+        + tuple(attribute for attribute, _, _, _ in OPTIONAL)
+    )
+
+    steamid: str
+    playerid: str
+    in_menu: bool
+    # Only read from payloads with player_weapons
+    knife_active: bool
+    current_round: int
+    ct_timeouts: int
+    t_timeouts: int
+    flashed: int
+    round_kills: int
+    round_killhs: int
+    mvps: int
+    kills: int
+    deaths: int
+    phase: str
+    win_team: Optional[str]
+    team: Optional[str]
+
+
+def _knife_active(player: dict) -> bool:
+    active = _active_weapon(player)
+    # Taser has no 'type' so we have to check for its name
+    return active is not None and (active[0] == "weapon_taser" or active[1] == "Knife")
+
+
+def decode(payload: Any) -> Optional[Gamestate]:
+    """Extracts the fields we need from a parsed payload.
+
+    Returns None if the payload doesn't describe a player (e.g. the game is in
+    the main menu before ever joining a server). Raises SchemaError if it is
+    invalid. Other fields are not looked at, and of the weapons only the
+    active one is.
+    """
+    if not isinstance(payload, dict):
+        raise SchemaError((), "payload is not an object")
+    if not payload.get("provider") or not payload.get("player"):
+        return None
+    if type(payload["provider"]) is not dict or type(payload["player"]) is not dict:
+        raise SchemaError((), "provider and player should be objects")
+
+    gamestate = Gamestate()
+    _fill(gamestate, payload, _HEADER)
+    activity = payload["player"].get("activity", _MISSING)
+    if type(activity) is not str:
+        activity = _check(("player", "activity"), str, activity, _MISSING)
+    gamestate.in_menu = activity == "menu"
+    if gamestate.in_menu:
+        return gamestate
+
+    _fill(gamestate, payload, _GROUPS)
+    gamestate.knife_active = _knife_active(payload["player"])
+    return gamestate
+
+
+# Where each attribute is read from, for fingerprinter()
+_PATHS: Dict[str, Tuple[str, ...]] = {
+    "steamid": ("provider", "steamid"),
+    "playerid": ("player", "steamid"),
+    "in_menu": ("player", "activity"),
+}
+_PATHS.update((attribute, path) for attribute, path, _ in REQUIRED)
+_PATHS.update((attribute, path) for attribute, path, _, _ in OPTIONAL)
+
+
+def fingerprinter(attributes: Sequence[str]) -> Callable[[Any], Optional[tuple]]:
+    """Returns a function reading the raw values that attributes are decoded from.
+
+    Payloads with the same values decode to the same attributes. Values are
+    looked up without any check, so this costs a fraction of decode(). The
+    function returns None when a required value is missing or a parent isn't an
+    object, in which case only decode() can tell.
+    """
+    optional = set(attribute for attribute, _, _, _ in OPTIONAL)
+    # List[(path, optional)], None for the weapon in hand
+    paths = [
+        (_PATHS.get(attribute), attribute in optional) for attribute in attributes
+    ]
+
+    def fingerprint(payload: Any) -> Optional[tuple]:
+        values = []
+        try:
+            for path, is_optional in paths:
+                if path is None:
+                    values.append(_active_weapon(payload["player"]))
+                elif is_optional:
+                    value = payload
+                    for key in path[:-1]:
+                        value = value.get(key, _EMPTY)
+                    values.append(value.get(path[-1]))
+                else:
+                    value = payload
+                    for key in path:
+                        value = value[key]
+                    values.append(value)
+        except (KeyError, TypeError, AttributeError):
+            return None
+        return tuple(values)
+
+    return fingerprint
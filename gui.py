@@ -5,6 +5,7 @@ from wxasync import AsyncBind, StartCoroutine  # type: ignore
 
 import client
 import config
+from profiling import KINDS, profiler
 
 
 class TaskbarIcon(wx.adv.TaskBarIcon):
@@ -18,6 +19,26 @@ class TaskbarIcon(wx.adv.TaskBarIcon):
         self.frame.Show()
         self.frame.Restore()
 
+    def CreatePopupMenu(self):
+        labels = {
+            "cpu": "Profile",
+            "sample": "Sample all threads",
+            "alloc": "Trace allocations",
+        }
+        menu = wx.Menu()
+        for kind in KINDS:
+            item = menu.Append(
+                wx.ID_ANY, f"{labels[kind]} for {config.settings.profile_seconds:g}s"
+            )
+            item.Enable(profiler.running is None)
+            self.Bind(wx.EVT_MENU, lambda evt, kind=kind: self.OnProfile(kind), item)
+        return menu
+
+    def OnProfile(self, kind):
+        profiler.start(
+            [kind], config.settings.profile_seconds, config.settings.profile_dir
+        )
+
 
 class MainFrame(wx.Frame):
     def __init__(self, *args, **kw):
@@ -27,7 +48,8 @@ class MainFrame(wx.Frame):
 
         self.CreateStatusBar()
         self.SetStatusText("Loading sounds...")
-        self.client = client.Client(self)
+        # The event loop runs on the GUI thread, no need for wx.CallAfter
+        self.client = client.Client(self, self.SetStatusText)
 
         vbox = wx.BoxSizer(wx.VERTICAL)
         vbox.AddStretchSpacer()
@@ -53,10 +75,12 @@ class MainFrame(wx.Frame):
         StartCoroutine(self.UpdateSounds(None), self)
 
     def make_volume_zone(self):
-        with self.client.sounds.lock:
-            self.volumeSlider = wx.Slider(
-                self.panel, value=self.client.sounds.volume, size=(272, 25)
-            )
+        self.volumeSlider = wx.Slider(
+            self.panel, value=config.settings.volume, size=(272, 25)
+        )
+        config.settings.subscribe(
+            "volume", lambda volume: wx.CallAfter(self.volumeSlider.SetValue, volume)
+        )
         AsyncBind(wx.EVT_COMMAND_SCROLL_CHANGED, self.OnVolumeSlider, self.volumeSlider)
 
         volumeZone = wx.StaticBoxSizer(wx.VERTICAL, self.panel, label="Volume")
@@ -81,15 +105,18 @@ class MainFrame(wx.Frame):
         settingsBox.Add(self.preferHeadshotsChk, border=5, flag=wx.ALL)
         settingsBox.Add(soundBtns, border=5, flag=wx.ALIGN_CENTER | wx.UP | wx.DOWN)
 
-        preferHeadshots = config.config["Sounds"].getboolean("PreferHeadshots", False)
-        self.preferHeadshotsChk.SetValue(preferHeadshots)
+        self.preferHeadshotsChk.SetValue(config.settings.prefer_headshots)
         self.Bind(
             wx.EVT_CHECKBOX,
-            lambda e: config.set(
-                "Sounds", "PreferHeadshots", self.preferHeadshotsChk.Value
+            lambda e: config.settings.set(
+                "prefer_headshots", self.preferHeadshotsChk.Value
             ),
             self.preferHeadshotsChk,
         )
+        config.settings.subscribe(
+            "prefer_headshots",
+            lambda prefer: wx.CallAfter(self.preferHeadshotsChk.SetValue, prefer),
+        )
 
         return settingsBox
 
@@ -100,15 +127,17 @@ class MainFrame(wx.Frame):
         super().SetStatusText(text)
 
     async def OnUnMinimize(self, event):
+        if not event.IsShown():
+            return
+        self.client.status.resume()
         await self.client.update_status()
 
     async def OnVolumeSlider(self, event):
-        config.set("Sounds", "Volume", self.volumeSlider.Value)
-        with self.client.sounds.lock:
-            # Volume didn't change
-            if self.client.sounds.volume == self.volumeSlider.Value:
-                return
-            self.client.sounds.volume = self.volumeSlider.Value
+        # Volume didn't change
+        if config.settings.volume == self.volumeSlider.Value:
+            return
+        # Written to config.ini once the slider stops moving
+        config.settings.set("volume", self.volumeSlider.Value)
         self.client.sounds.play("Headshot")
 
     async def OpenSoundsDir(self, event):
@@ -121,6 +150,7 @@ class MainFrame(wx.Frame):
 
     async def OnMinimize(self, event):
         if self.IsIconized():
+            self.client.status.pause()
             self.Hide()
 
     async def OnClose(self, event):
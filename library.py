@@ -0,0 +1,61 @@
+"""Index of the sound files available on disk"""
+import os
+from typing import Dict, List, NamedTuple
+
+SOUNDS_DIR = "sounds"
+
+
+class SoundFile(NamedTuple):
+    category: str
+    size: int
+    mtime: int
+
+
+class Changes(NamedTuple):
+    added: List[str]
+    changed: List[str]
+    removed: List[str]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def categories(self, old: Dict[str, SoundFile], new: Dict[str, SoundFile]):
+        """Returns the categories affected by these changes."""
+        touched = set(new[path].category for path in self.added + self.changed)
+        touched.update(old[path].category for path in self.removed + self.changed)
+        return touched
+
+
+def is_sound_file(file: str) -> bool:
+    return not (file.startswith(".git") or file == "desktop.ini")
+
+
+def scan(directory: str = SOUNDS_DIR) -> Dict[str, SoundFile]:
+    """Lists every sound file, in a single pass over the category folders."""
+    index: Dict[str, SoundFile] = {}
+    try:
+        categories = list(os.scandir(directory))
+    except FileNotFoundError:
+        return index
+
+    for category in categories:
+        if not category.is_dir():
+            continue
+        try:
+            files = list(os.scandir(category.path))
+        except OSError:
+            continue
+        for file in files:
+            if not is_sound_file(file.name) or not file.is_file():
+                continue
+            stat = file.stat()
+            index[file.path] = SoundFile(category.name, stat.st_size, stat.st_mtime_ns)
+    return index
+
+
+def diff(old: Dict[str, SoundFile], new: Dict[str, SoundFile]) -> Changes:
+    """Compares two scans of the sounds directory."""
+    added = [path for path in new if path not in old]
+    removed = [path for path in old if path not in new]
+    changed = [path for path in new if path in old and new[path] != old[path]]
+    return Changes(added, changed, removed)
@@ -0,0 +1,493 @@
+"""Stress-tests gamestate ingestion with synthetic game clients.
+
+Usage : python loadgen.py [--feeds 4] [--rate 20] [--duration 10]
+                          [--url http://127.0.0.1:3000 | --inprocess]
+
+Each feed simulates a player going from the main menu through warmup, live
+rounds (kills, headshots, knife kills, collaterals, teamkills, suicides, deaths,
+flashes, timeouts, spectating teammates once dead), match end and back to the menu. Feeds post at --rate
+updates per second each over their own keep-alive connection (0 means as fast
+as the server answers).
+
+By default the payloads go to a server started in this process, so sound
+triggers can be timed. --url targets a running app instead, whose /metrics has
+the trigger latencies. --inprocess skips HTTP and calls CSGOState.update().
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import time
+from collections import Counter
+from typing import List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import gsi
+import server
+from replay import ReplayClient, percentile
+from state import CSGOState
+
+# Chance, per update, of each event during a live round
+KILL_CHANCE = 0.08
+HEADSHOT_CHANCE = 0.4
+# Of the kills, one bullet killing two players
+COLLATERAL_CHANCE = 0.1
+TEAMKILL_CHANCE = 0.005
+SUICIDE_CHANCE = 0.005
+DEATH_CHANCE = 0.03
+FLASH_CHANCE = 0.04
+TIMEOUT_CHANCE = 0.02
+WEAPON_SWITCH_CHANCE = 0.1
+# Chance of a heartbeat, identical to the last payload but for its timestamp
+HEARTBEAT_CHANCE = 0.1
+
+ROUNDS_PER_MATCH = 30
+# Players on the other team
+MAX_ROUND_KILLS = 5
+# (name, type, how often it is switched to)
+WEAPONS = [
+    ("weapon_knife", "Knife", 1),
+    ("weapon_taser", None, 1),
+    ("weapon_ak47", "Rifle", 12),
+    ("weapon_glock", "Pistol", 4),
+    ("weapon_flashbang", "Grenade", 2),
+]
+
+
+class Match:
+    """One simulated game client, producing its successive payloads."""
+
+    def __init__(self, index: int, seed: int) -> None:
+        self.rng = random.Random(seed * 1000 + index)
+        self.token = f"loadgen-{index}"
+        self.steamid = str(76561198000000000 + index * 100)
+        self.timestamp = 1600000000
+        self.last: Optional[dict] = None
+        self.new_match()
+        # Starts in the main menu
+        self.activity = "menu"
+        self.ticks = self.rng.randint(2, 10)
+
+    def new_match(self) -> None:
+        self.activity = "playing"
+        self.map_phase = "warmup"
+        self.round_phase = "freezetime"
+        self.ticks = self.rng.randint(5, 20)
+        self.round = 0
+        self.team = self.rng.choice(["CT", "T"])
+        self.win_team: Optional[str] = None
+        self.kills = self.deaths = self.mvps = 0
+        self.round_kills = self.round_killhs = 0
+        self.timeouts = {"CT": 4, "T": 4}
+        self.flashed = 0
+        self.weapon = 2
+        self.alive = True
+        self.spectating: Optional[str] = None
+
+    def advance(self) -> None:
+        """Moves the simulation one update forward."""
+        rng = self.rng
+        self.ticks = self.ticks - 1
+        self.flashed = max(self.flashed - 60, 0)
+
+        if self.activity == "menu":
+            if self.ticks <= 0:
+                self.new_match()
+            return
+        if self.map_phase == "warmup":
+            if self.ticks <= 0:
+                self.map_phase = "live"
+                self.start_round()
+            return
+        if self.map_phase == "gameover":
+            if self.ticks <= 0:
+                self.activity = "menu"
+                self.ticks = rng.randint(2, 10)
+            return
+
+        if self.round_phase == "freezetime":
+            if rng.random() < TIMEOUT_CHANCE:
+                team = rng.choice(["CT", "T"])
+                self.timeouts[team] = max(self.timeouts[team] - 1, 0)
+            if self.ticks <= 0:
+                self.round_phase = "live"
+                self.ticks = rng.randint(20, 60)
+        elif self.round_phase == "live":
+            if self.alive:
+                self.fight()
+            elif self.spectating is None:
+                # The game reports the death first, then switches to a teammate
+                self.spectating = str(int(self.steamid) + rng.randint(1, 4))
+            if self.ticks <= 0:
+                self.round_phase = "over"
+                self.win_team = rng.choice(["CT", "T"])
+                if self.win_team == self.team and self.round_kills >= 2:
+                    self.mvps = self.mvps + 1
+                self.ticks = rng.randint(3, 8)
+        elif self.ticks <= 0:
+            if self.round >= ROUNDS_PER_MATCH:
+                self.map_phase = "gameover"
+                self.ticks = rng.randint(3, 8)
+            else:
+                self.start_round()
+
+    def fight(self) -> None:
+        rng = self.rng
+        if rng.random() < WEAPON_SWITCH_CHANCE:
+            self.weapon = rng.choices(
+                range(len(WEAPONS)), [weight for _, _, weight in WEAPONS]
+            )[0]
+        if rng.random() < FLASH_CHANCE:
+            self.flashed = 255
+        if rng.random() < KILL_CHANCE and self.round_kills < MAX_ROUND_KILLS:
+            count = 2 if rng.random() < COLLATERAL_CHANCE else 1
+            count = min(count, MAX_ROUND_KILLS - self.round_kills)
+            self.kills = self.kills + count
+            self.round_kills = self.round_kills + count
+            if rng.random() < HEADSHOT_CHANCE:
+                self.round_killhs = self.round_killhs + 1
+        elif rng.random() < TEAMKILL_CHANCE:
+            # Killing a teammate costs a kill
+            self.kills = self.kills - 1
+        elif rng.random() < SUICIDE_CHANCE:
+            self.kills = self.kills - 1
+            self.deaths = self.deaths + 1
+            self.alive = False
+        elif rng.random() < DEATH_CHANCE:
+            self.deaths = self.deaths + 1
+            # Dead players spectate a teammate until the round ends
+            self.alive = False
+
+    def start_round(self) -> None:
+        self.round = self.round + 1
+        self.round_phase = "freezetime"
+        self.ticks = self.rng.randint(3, 10)
+        self.round_kills = self.round_killhs = 0
+        self.win_team = None
+        self.alive = True
+        self.spectating = None
+        self.weapon = 2
+        if self.round == ROUNDS_PER_MATCH // 2 + 1:
+            self.team = "T" if self.team == "CT" else "CT"
+
+    def weapon_info(self, i: int) -> dict:
+        name, kind, _ = WEAPONS[i]
+        info = {"name": name, "state": "active" if i == self.weapon else "holstered"}
+        # Like the taser, some weapons have no type
+        if kind is not None:
+            info["type"] = kind
+        return info
+
+    def payload(self) -> dict:
+        """Returns the next payload."""
+        self.timestamp = self.timestamp + 1
+        if self.last is not None and self.rng.random() < HEARTBEAT_CHANCE:
+            self.last["provider"]["timestamp"] = self.timestamp
+            return self.last
+        self.advance()
+        payload: dict = {
+            "provider": {
+                "name": "Counter-Strike: Global Offensive",
+                "appid": 730,
+                "version": 13775,
+                "steamid": self.steamid,
+                "timestamp": self.timestamp,
+            },
+            "auth": {"token": self.token},
+        }
+        if self.activity == "menu":
+            payload["player"] = {
+                "steamid": self.steamid,
+                "name": "loadgen",
+                "activity": "menu",
+            }
+            self.last = payload
+            return payload
+
+        payload["map"] = {
+            "mode": "competitive",
+            "name": "de_dust2",
+            "phase": self.map_phase,
+            "round": self.round,
+            "team_ct": {"score": 0, "timeouts_remaining": self.timeouts["CT"]},
+            "team_t": {"score": 0, "timeouts_remaining": self.timeouts["T"]},
+        }
+        if self.map_phase != "warmup":
+            payload["round"] = {"phase": self.round_phase}
+            if self.round_phase == "over":
+                payload["round"]["win_team"] = self.win_team
+
+        spectated = self.spectating is not None
+        payload["player"] = {
+            "steamid": self.spectating if spectated else self.steamid,
+            "name": "teammate" if spectated else "loadgen",
+            "team": self.team,
+            "activity": "playing",
+            "match_stats": {
+                "kills": 0 if spectated else self.kills,
+                "deaths": 0 if spectated else self.deaths,
+                "mvps": 0 if spectated else self.mvps,
+                "assists": 0,
+                "score": 0,
+            },
+            "state": {
+                "health": 100,
+                "armor": 100,
+                "flashed": 0 if spectated else self.flashed,
+                "round_kills": 0 if spectated else self.round_kills,
+                "round_killhs": 0 if spectated else self.round_killhs,
+            },
+            "weapons": {f"weapon_{i}": self.weapon_info(i) for i in range(len(WEAPONS))},
+        }
+        self.last = payload
+        return payload
+
+
+def script(match: Match, length: int) -> List[bytes]:
+    """Pregenerates payloads, so generating them doesn't slow the run down."""
+    return [json.dumps(match.payload()).encode() for _ in range(length)]
+
+
+class LoadSounds:
+    """Stands in for SoundManager, timing triggers from payload receipt."""
+
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.categories: Counter = Counter()
+
+    def post(self, sound_names: Sequence[str], received: Optional[float] = None) -> None:
+        if received is not None:
+            self.latencies.append(time.monotonic() - received)
+        self.categories[sound_names[0]] += 1
+
+    def prefetch(self, sound_name: str) -> None:
+        pass
+
+
+class Results:
+    def __init__(self) -> None:
+        self.sent = 0
+        self.completed = 0
+        self.dropped = 0
+        self.late = 0
+        # Of the first dropped update
+        self.error: Optional[str] = None
+        # Seconds from the scheduled send time to the response
+        self.latencies: List[float] = []
+
+    def done(self, scheduled: float, late: float) -> None:
+        latency = time.monotonic() - scheduled
+        self.completed = self.completed + 1
+        self.latencies.append(latency)
+        if latency > late:
+            self.late = self.late + 1
+
+
+def run_inprocess(
+    scripts: List[List[bytes]], rate: float, duration: float, late: float
+) -> Tuple[Results, LoadSounds]:
+    """Calls CSGOState.update() directly, feeds taking turns."""
+    sounds = LoadSounds()
+    state = CSGOState(ReplayClient(sounds), listen=False)
+    results = Results()
+    interval = 1.0 / (rate * len(scripts)) if rate > 0 else 0.0
+    start = time.monotonic()
+    i = 0
+    while time.monotonic() - start < duration:
+        scheduled = start + i * interval if interval else time.monotonic()
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        body = scripts[i % len(scripts)][(i // len(scripts)) % len(scripts[0])]
+        results.sent = results.sent + 1
+        state.update(gsi.loads(body), scheduled)
+        results.done(scheduled, late)
+        i = i + 1
+    return results, sounds
+
+
+async def post_feed(
+    host: str,
+    port: int,
+    bodies: List[bytes],
+    rate: float,
+    offset: float,
+    deadline: float,
+    late: float,
+    timeout: float,
+    results: Results,
+) -> None:
+    """Posts a feed's payloads over one keep-alive connection, reconnecting after
+    errors. Updates that fail or time out are dropped, not retried."""
+    reader: Optional[asyncio.StreamReader] = None
+    writer: Optional[asyncio.StreamWriter] = None
+    start = time.monotonic() + offset
+    i = 0
+    while time.monotonic() < deadline:
+        scheduled = start + i / rate if rate > 0 else time.monotonic()
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        body = bodies[i % len(bodies)]
+        i = i + 1
+        results.sent = results.sent + 1
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, port), timeout
+                )
+            writer.write(
+                b"POST / HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n"
+                b"Content-Length: %d\r\n\r\n" % (host.encode(), len(body))
+            )
+            writer.write(body)
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)  # type: ignore
+            if not head.startswith(b"HTTP/1.1 200"):
+                raise ConnectionError(head.split(b"\r\n", 1)[0].decode("latin-1"))
+            results.done(scheduled, late)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as err:
+            if results.error is None:
+                results.error = repr(err)
+            results.dropped = results.dropped + 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_http(
+    scripts: List[List[bytes]],
+    rate: float,
+    duration: float,
+    late: float,
+    timeout: float,
+    url: Optional[str],
+) -> Tuple[Results, Optional[LoadSounds]]:
+    """Posts every feed concurrently, to url or to a server started here."""
+    sounds = None
+    listener = None
+    if url is None:
+        sounds = LoadSounds()
+        state = CSGOState(ReplayClient(sounds), listen=False)
+        listener = await server.serve(state, "127.0.0.1", 0)
+        host, port = "127.0.0.1", listener.sockets[0].getsockname()[1]
+    else:
+        parts = urlsplit(url)
+        host, port = parts.hostname or "127.0.0.1", parts.port or 80
+
+    results = Results()
+    deadline = time.monotonic() + duration
+    # Feeds are staggered over an update interval, like unsynchronized game clients
+    stagger = 1.0 / rate / len(scripts) if rate > 0 else 0.0
+    await asyncio.gather(
+        *[
+            post_feed(
+                host, port, bodies, rate, i * stagger, deadline, late, timeout, results
+            )
+            for i, bodies in enumerate(scripts)
+        ]
+    )
+    if listener is not None:
+        listener.close()
+        await listener.wait_closed()
+    return results, sounds
+
+
+def milliseconds(values: List[float]) -> str:
+    if not values:
+        return "n/a"
+    return (
+        f"p50 {percentile(values, 0.5) * 1e3:.2f}ms, "
+        f"p90 {percentile(values, 0.9) * 1e3:.2f}ms, "
+        f"p99 {percentile(values, 0.99) * 1e3:.2f}ms, "
+        f"max {max(values) * 1e3:.2f}ms"
+    )
+
+
+def report(
+    results: Results, sounds: Optional[LoadSounds], elapsed: float, target: float
+) -> None:
+    dropped = results.dropped * 100.0 / results.sent if results.sent else 0.0
+    print(
+        f"{results.sent} updates sent, {results.completed} completed, "
+        f"{results.dropped} dropped ({dropped:.1f}%), {results.late} late"
+    )
+    if results.error is not None:
+        print(f"[!] First dropped update : {results.error}")
+    throughput = results.completed / elapsed if elapsed > 0 else 0.0
+    print(
+        f"throughput : {throughput:.0f} updates/s"
+        + (f" (target {target:.0f})" if target > 0 else "")
+    )
+    print(f"latency from schedule : {milliseconds(results.latencies)}")
+    if sounds is None:
+        print("trigger latencies : see /metrics of the target")
+        return
+    print(
+        f"{len(sounds.latencies)} triggers, latency from receipt : "
+        f"{milliseconds(sounds.latencies)}"
+    )
+    for category, count in sounds.categories.most_common():
+        print(f"    {count:6}  {category}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--feeds", type=int, default=4, help="simulated game clients")
+    parser.add_argument(
+        "--rate", type=float, default=20.0, help="updates/s per feed, 0 for max"
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--url", help="post to a running app, e.g. http://127.0.0.1:3000")
+    parser.add_argument(
+        "--inprocess", action="store_true", help="call CSGOState.update() directly"
+    )
+    parser.add_argument(
+        "--late-ms", type=float, default=50.0, help="updates slower than this are late"
+    )
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--verbose", action="store_true", help="show what the state machine prints"
+    )
+    parser.add_argument(
+        "--script-length", type=int, default=2000, help="payloads generated per feed"
+    )
+    args = parser.parse_args()
+
+    scripts = [
+        script(Match(i, args.seed), args.script_length) for i in range(args.feeds)
+    ]
+    late = args.late_ms / 1000.0
+    target = args.rate * args.feeds
+    print(
+        f"[*] {args.feeds} feeds, "
+        + (f"{args.rate:g} updates/s each" if args.rate > 0 else "max rate")
+        + f", {args.duration:g}s, "
+        + ("in process" if args.inprocess else args.url or "local server")
+    )
+
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            # Every feed prints its round events, which would drown the report
+            stack.enter_context(
+                contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w")))
+            )
+        start = time.monotonic()
+        if args.inprocess:
+            results, sounds = run_inprocess(scripts, args.rate, args.duration, late)
+        else:
+            results, sounds = asyncio.run(
+                run_http(
+                    scripts, args.rate, args.duration, late, args.timeout, args.url
+                )
+            )
+        elapsed = time.monotonic() - start
+    report(results, sounds, elapsed, target)
+
+
+if __name__ == "__main__":
+    main()
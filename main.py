@@ -1,79 +1,32 @@
 """Plays quake sounds according to CSGO Gamestate"""
+# Imported first, to time the other imports
+from timeline import startup
+
+import argparse
 import asyncio
-import os
-import wx  # type: ignore  # type: ignore
-from openal import oalInit, oalQuit  # type: ignore
-from pathlib import Path
-from shutil import copyfile
-from wxasync import WxAsyncApp  # type: ignore
+import logging
+import multiprocessing
+from threading import Thread
 
 # Local files
-import gui
-import steamfiles
+import config
+from profiling import KINDS, profiler
+from steam import install_gsi_config
 
 
-def get_steam_path() -> str:
-    if os.name == "nt":  # windows
-        import winreg  # type: ignore
+def start_profiling(kinds, seconds):
+    if kinds:
+        seconds = seconds if seconds is not None else config.settings.profile_seconds
+        profiler.start(kinds, seconds, config.settings.profile_dir)
 
-        key = winreg.OpenKey(
-            winreg.HKEY_LOCAL_MACHINE,
-            "SOFTWARE\\WOW6432Node\\Valve\\Steam",
-            0,
-            winreg.KEY_READ,
-        )
-        value, regtype = winreg.QueryValueEx(key, "InstallPath")
-        winreg.CloseKey(key)
-        return value
-    else:
-        return os.path.join(Path.home(), ".steam/root")
-
-
-def get_csgo_path(steamapps_folder):
-    # Get every SteamLibrary folder
-    with open(os.path.join(steamapps_folder, "libraryfolders.vdf")) as infile:
-        libraryfolders = steamfiles.load(infile)
-    folders = [steamapps_folder]
-    i = 1
-    while True:
-        try:
-            steamapps = os.path.join(
-                libraryfolders["LibraryFolders"][str(i)], "steamapps"
-            )
-            print(f"Found steamapps folder {steamapps}")
-            folders.append(steamapps)
-        except KeyError:
-            break
-        i = i + 1
-
-    # Find the one CS:GO is in
-    for folder in folders:
-        try:
-            appmanifest = os.path.join(folder, "appmanifest_730.acf")
-            print(f"Opening appmanifest {appmanifest}...")
-            with open(appmanifest) as infile:
-                appmanifest = steamfiles.load(infile)
-                installdir = os.path.join(
-                    folder, "common", appmanifest["AppState"]["installdir"]
-                )
-            print(f"Valid installdir found: {installdir}")
-            return installdir
-        except FileNotFoundError:
-            continue
-
-    print("CS:GO not found :/")
 
+def run_gui(args):
+    import wx  # type: ignore
+    from wxasync import WxAsyncApp  # type: ignore
 
-def main():
-    # Ensure gamestate integration cfg is in csgo's cfg directory
-    csgo_dir = get_csgo_path(os.path.join(get_steam_path(), "steamapps"))
-    if csgo_dir is not None:
-        copyfile(
-            "gamestate_integration_ccs.cfg",
-            os.path.join(csgo_dir, "csgo", "cfg", "gamestate_integration_ccs.cfg"),
-        )
+    import gui
 
-    oalInit()
+    startup.mark("wx imported")
     loop = asyncio.get_event_loop()
     app = WxAsyncApp()
     gui.MainFrame(
@@ -82,8 +35,68 @@ def main():
         size=wx.Size(320, 230),
         style=wx.DEFAULT_FRAME_STYLE & ~(wx.RESIZE_BORDER | wx.MAXIMIZE_BOX),
     )
+    startup.mark("window shown")
+    loop.call_soon(start_profiling, args.profile, args.profile_seconds)
     loop.run_until_complete(app.MainLoop())
 
+
+async def run_headless(args):
+    """Runs sounds and gamestate tracking without wxPython."""
+    from client import Client
+
+    status = None
+    if args.log:
+        from status import LogStatus
+
+        logging.basicConfig(
+            filename=args.log, level=logging.INFO, format="%(asctime)s %(message)s"
+        )
+        status = LogStatus()
+    client = Client(status=status)
+    start_profiling(args.profile, args.profile_seconds)
+    await client.reload_sounds()
+    # Serve until interrupted
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--headless", action="store_true", help="run without a window (no wxPython)"
+    )
+    parser.add_argument(
+        "--log", metavar="FILE", help="with --headless, write status messages to FILE"
+    )
+    parser.add_argument(
+        "--profile",
+        action="append",
+        choices=KINDS,
+        help="profile the first seconds after startup (can be repeated)",
+    )
+    parser.add_argument(
+        "--profile-seconds",
+        type=float,
+        help="length of the profile, ProfileSeconds in config.ini by default",
+    )
+    args = parser.parse_args()
+    startup.mark("main imports")
+
+    # Steam discovery reads files on possibly slow drives : do it while the
+    # audio device and the window come up.
+    Thread(target=install_gsi_config, daemon=True).start()
+
+    from openal import oalInit, oalQuit  # type: ignore
+
+    oalInit()
+    startup.mark("openal initialized")
+    try:
+        if args.headless:
+            asyncio.run(run_headless(args))
+        else:
+            run_gui(args)
+    except KeyboardInterrupt:
+        pass
+
     # Freeing OpenAL buffers might fail if they are still in use
     # We don't really care since the OS will clean up anyway.
     try:
@@ -93,4 +106,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Sounds are decoded in worker processes, which frozen builds must support
+    multiprocessing.freeze_support()
     main()
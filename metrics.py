@@ -0,0 +1,127 @@
+"""In-process latency histograms, from GSI POST receipt to audio start"""
+import json
+import math
+from threading import Lock
+from typing import Dict, List
+
+# Buckets are split in SUBBUCKETS per power of two, from 2^MIN_EXP seconds (~1us)
+SUBBUCKETS = 4
+MIN_EXP = -20
+MAX_EXP = 5
+NB_BUCKETS = (MAX_EXP - MIN_EXP) * SUBBUCKETS
+
+
+class Histogram:
+    """Log-scale histogram of durations in seconds, cheap to record into."""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * NB_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if seconds <= 0:
+            self.counts[0] += 1
+            return
+        mantissa, exp = math.frexp(seconds)
+        # mantissa is in [0.5, 1)
+        bucket = (exp - MIN_EXP) * SUBBUCKETS + int((mantissa - 0.5) * 2 * SUBBUCKETS)
+        self.counts[min(max(bucket, 0), NB_BUCKETS - 1)] += 1
+
+    @staticmethod
+    def upper_bound(bucket: int) -> float:
+        exp, sub = divmod(bucket, SUBBUCKETS)
+        return math.ldexp(0.5 + (sub + 1) / (2 * SUBBUCKETS), exp + MIN_EXP)
+
+    def percentile(self, p: float) -> float:
+        """Returns an upper bound of the p-th percentile (p between 0 and 1)."""
+        if self.count == 0:
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return min(self.upper_bound(bucket), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """Returns count, mean, p50, p90, p99 and max, in milliseconds."""
+        mean = self.total / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "mean_ms": mean * 1e3,
+            "p50_ms": self.percentile(0.5) * 1e3,
+            "p90_ms": self.percentile(0.9) * 1e3,
+            "p99_ms": self.percentile(0.99) * 1e3,
+            "max_ms": self.max * 1e3,
+        }
+
+
+class Metrics:
+    """Histograms per pipeline stage and per sound category."""
+
+    # Stages, in pipeline order
+    STAGES = ("receive", "decode", "build", "compare", "queue", "play", "total")
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.stages: Dict[str, Histogram] = {stage: Histogram() for stage in self.STAGES}
+        # Receipt to audio start, per sound category
+        self.categories: Dict[str, Histogram] = {}
+        # Dict[name:count], e.g. payloads skipped as duplicates
+        self.counters: Dict[str, int] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        # Recording happens on the event loop, the lock only guards against
+        # readers from other threads.
+        with self.lock:
+            self.stages[stage].record(seconds)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_sound(self, category: str, seconds: float) -> None:
+        with self.lock:
+            histogram = self.categories.get(category)
+            if histogram is None:
+                histogram = self.categories[category] = Histogram()
+            histogram.record(seconds)
+            self.stages["total"].record(seconds)
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                "stages": {
+                    stage: histogram.summary()
+                    for stage, histogram in self.stages.items()
+                },
+                "categories": {
+                    category: histogram.summary()
+                    for category, histogram in sorted(self.categories.items())
+                },
+                "counters": dict(self.counters),
+            }
+
+    def to_json(self) -> bytes:
+        return json.dumps(self.summary(), indent=2).encode()
+
+    def status_text(self) -> str:
+        """One line for the status bar."""
+        with self.lock:
+            total = self.stages["total"]
+            return (
+                f"Latency p50 {total.percentile(0.5) * 1e3:.1f}ms, "
+                f"p99 {total.percentile(0.99) * 1e3:.1f}ms"
+            )
+
+
+metrics = Metrics()
@@ -0,0 +1,267 @@
+"""Profiles the app for a few seconds, on demand.
+
+Three kinds of profiles, any of which can run during the same window :
+- cpu : deterministic profile (cProfile) of the event loop thread, where
+gamestates are received, compared and sounds are played, and where the GUI
+runs. Written as .prof, for snakeviz or python -m pstats.
+- sample : every thread's stack, sampled SAMPLE_INTERVAL apart. Written as
+folded stacks (.folded), for speedscope or flamegraph.pl.
+- alloc : tracemalloc snapshot of what was allocated during the window and is
+still alive at its end. Written as .snapshot, for tracemalloc.Snapshot.load().
+
+Each profile comes with a .txt summary splitting time and memory per subsystem.
+Nothing is hooked outside of a window, and the profiling modules are only
+imported when one starts.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+KINDS = ("cpu", "sample", "alloc")
+SAMPLE_INTERVAL = 0.005
+# Frames kept per allocation
+ALLOC_FRAMES = 16
+
+# Dict[subsystem:modules], matched against file names and package directories
+SUBSYSTEMS: Dict[str, Tuple[str, ...]] = {
+    "ingest": ("server.py", "gsi.py", "recording.py", "json", "orjson"),
+    "state diff": ("state.py", "rules.py"),
+    "audio": (
+        "sounds.py",
+        "voices.py",
+        "events.py",
+        "buffers.py",
+        "soundcache.py",
+        "soundbank.py",
+        "decoder.py",
+        "openal",
+        "pyogg",
+    ),
+    "gui": ("gui.py", "client.py", "status.py", "wx", "wxasync"),
+}
+# Where threads block when they have nothing to do : the event loop in select(),
+# pool threads waiting for work. Only counts when it is the innermost frame.
+IDLE = ("selectors.py", "windows_events.py", "thread.py", "threading.py", "queue.py")
+
+
+def subsystem(filename: str) -> Optional[str]:
+    """Returns the subsystem a source file belongs to, if any."""
+    parts = filename.replace("\\", "/").split("/")
+    for name, modules in SUBSYSTEMS.items():
+        for module in modules:
+            if parts[-1] == module or module in parts[:-1]:
+                return name
+    return None
+
+
+def cpu_report(profile: Any) -> str:
+    """Self time per subsystem, then the slowest functions."""
+    import pstats
+
+    stats = pstats.Stats(profile)
+    times: Counter = Counter()
+    for (filename, _, _), (_, _, tottime, _, callers) in stats.stats.items():  # type: ignore
+        if filename != "~":
+            times[subsystem(filename) or "other"] += tottime
+            continue
+        # Built-ins (e.g. OpenAL calls through ctypes) count for their callers
+        for (caller, _, _), caller_stats in callers.items():
+            if os.path.basename(caller) in IDLE:
+                times["idle"] += caller_stats[2]
+            else:
+                times[subsystem(caller) or "other"] += caller_stats[2]
+
+    out = io.StringIO()
+    out.write("Self time per subsystem, in ms :\n")
+    for name, seconds in times.most_common():
+        out.write(f"  {name:12} {seconds * 1000.0:10.1f}\n")
+    out.write("\n")
+    stats.stream = out  # type: ignore
+    stats.sort_stats("cumulative").print_stats(40)
+    return out.getvalue()
+
+
+class Sampler(threading.Thread):
+    """Samples the stacks of every other thread until stopped."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+        # Counter[folded stack]
+        self.stacks: Counter = Counter()
+        self.nb_samples = 0
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.nb_samples = self.nb_samples + 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+    def report(self) -> str:
+        """Samples per subsystem, by the innermost frame belonging to one."""
+        counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            filenames = [frame[frame.rfind("(") + 1 : -1] for frame in stack.split(";")]
+            if filenames[-1] in IDLE:
+                counts["idle"] += count
+                continue
+            found = (subsystem(filename) for filename in reversed(filenames[1:]))
+            counts[next((name for name in found if name is not None), "other")] += count
+        total = sum(counts.values()) or 1
+        lines = [f"{self.nb_samples} samples, {SAMPLE_INTERVAL * 1000.0:g} ms apart"]
+        lines.append("Samples per subsystem, all threads :")
+        for name, count in counts.most_common():
+            lines.append(f"  {name:12} {count:8} {count * 100.0 / total:5.1f}%")
+        return "\n".join(lines) + "\n"
+
+
+def alloc_report(snapshot: Any) -> str:
+    """Live memory allocated during the window, per subsystem and per line."""
+    import tracemalloc
+
+    # Without the profiler's own allocations
+    snapshot = snapshot.filter_traces(
+        [
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ]
+    )
+    sizes: Counter = Counter()
+    for stat in snapshot.statistics("filename"):
+        sizes[subsystem(stat.traceback[0].filename) or "other"] += stat.size
+    lines = ["Memory allocated during the window and still alive, in KiB :"]
+    for name, size in sizes.most_common():
+        lines.append(f"  {name:12} {size / 1024.0:10.1f}")
+    lines.append("")
+    lines.append("Top allocation sites :")
+    for stat in snapshot.statistics("lineno")[:30]:
+        lines.append(f"  {stat}")
+    return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """Runs one profiling window at a time. start() and stop() must be called
+    from the event loop thread."""
+
+    def __init__(self) -> None:
+        # Path of the running window's files, without extension
+        self.running: Optional[str] = None
+        # cProfile.Profile
+        self.profile: Any = None
+        self.sampler: Optional[Sampler] = None
+        self.alloc = False
+        # False if tracemalloc was already running, e.g. from PYTHONTRACEMALLOC
+        self.stop_tracing = False
+
+    def start(
+        self, kinds: Sequence[str], seconds: float, directory: str = "profiles"
+    ) -> Optional[str]:
+        """Starts a window of seconds. Returns the path of its files, without
+        extension, or None if a window is already running."""
+        if self.running is not None:
+            return None
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as err:
+            print(f"[!] Could not create {directory} : {err}")
+            return None
+        self.running = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S"))
+
+        if "alloc" in kinds:
+            import tracemalloc
+
+            self.alloc = True
+            self.stop_tracing = not tracemalloc.is_tracing()
+            if self.stop_tracing:
+                tracemalloc.start(ALLOC_FRAMES)
+        if "sample" in kinds:
+            self.sampler = Sampler()
+            self.sampler.start()
+        if "cpu" in kinds:
+            import cProfile
+
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+        print(f"[*] Profiling ({', '.join(kinds)}) for {seconds:g} seconds")
+        asyncio.get_event_loop().call_later(seconds, self.stop)
+        return self.running
+
+    def stop(self) -> None:
+        """Ends the window, then writes its files from a thread."""
+        profile, self.profile = self.profile, None
+        if profile is not None:
+            profile.disable()
+        sampler, self.sampler = self.sampler, None
+        if sampler is not None:
+            sampler.stopped.set()
+        alloc, self.alloc = self.alloc, False
+        asyncio.get_event_loop().run_in_executor(
+            None, self.write, self.running, profile, sampler, alloc
+        )
+
+    def write(
+        self,
+        path: str,
+        profile: Any,
+        sampler: Optional[Sampler],
+        alloc: bool,
+    ) -> None:
+        try:
+            reports: List[str] = []
+            if alloc:
+                import tracemalloc
+
+                snapshot = tracemalloc.take_snapshot()
+                if self.stop_tracing:
+                    tracemalloc.stop()
+                snapshot.dump(path + ".snapshot")
+                reports.append(alloc_report(snapshot))
+            if sampler is not None:
+                sampler.join()
+                with open(path + ".folded", "w") as outfile:
+                    outfile.write(sampler.folded())
+                reports.append(sampler.report())
+            if profile is not None:
+                profile.dump_stats(path + ".prof")
+                reports.append(cpu_report(profile))
+            with open(path + ".txt", "w") as outfile:
+                outfile.write("\n".join(reports))
+            print(f"[*] Profile written to {path}.*")
+        except OSError as err:
+            print(f"[!] Could not write profile {path} : {err}")
+        finally:
+            self.running = None
+
+    def endpoint(self, kinds: Sequence[str], seconds: float, directory: str) -> bytes:
+        """Body of the /profile/* routes."""
+        if self.running is not None:
+            return json.dumps({"started": False, "error": "already profiling"}).encode()
+        path = self.start(kinds, seconds, directory)
+        if path is None:
+            return json.dumps({"started": False, "error": "no profile directory"}).encode()
+        return json.dumps({"started": True, "seconds": seconds, "path": path}).encode()
+
+
+profiler = Profiler()
@@ -0,0 +1,42 @@
+"""Records raw Gamestate Integration payloads to a compact log file
+
+Each record is a little-endian header (timestamp as a double, body length as an
+unsigned int) followed by the raw POST body.
+"""
+import struct
+import time
+from typing import Iterator, Tuple
+
+HEADER = struct.Struct("<dI")
+
+
+class Recorder:
+    """Appends timestamped payloads to a recording."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "ab")
+        print(f"[*] Recording gamestate to {path}")
+
+    def write(self, body: bytes) -> None:
+        self.file.write(HEADER.pack(time.time(), len(body)))
+        self.file.write(body)
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read(path: str) -> Iterator[Tuple[float, bytes]]:
+    """Yields (timestamp, body) for every payload of a recording."""
+    with open(path, "rb") as infile:
+        while True:
+            header = infile.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            timestamp, length = HEADER.unpack(header)
+            body = infile.read(length)
+            if len(body) < length:
+                # Truncated record, the app was probably killed while writing
+                return
+            yield timestamp, body
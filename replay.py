@@ -0,0 +1,130 @@
+"""Replays a gamestate recording through the state machine, without game or audio.
+
+Usage : python replay.py <recording> [--realtime] [--quiet]
+
+Recordings are made by setting RecordPath in the [Debug] section of config.ini.
+"""
+import argparse
+import os
+import time
+from typing import List, Optional, Sequence, Set, Tuple
+
+import library
+import recording
+from state import CSGOState
+
+
+class ReplaySounds:
+    """Stands in for SoundManager, remembering which categories were triggered."""
+
+    def __init__(self, categories: Optional[Set[str]] = None) -> None:
+        # None means every category has sounds
+        self.categories = categories
+        self.played: List[Tuple[float, str]] = []
+        self.timestamp = 0.0
+
+    def play(self, sound_name: str) -> bool:
+        if self.categories is not None and sound_name not in self.categories:
+            return False
+        self.played.append((self.timestamp, sound_name))
+        return True
+
+    def post(self, sound_names: Sequence[str], received=None) -> None:
+        for sound_name in sound_names:
+            if self.play(sound_name):
+                break
+
+    def prefetch(self, sound_name: str) -> None:
+        pass
+
+
+class ReplayClient:
+    def __init__(self, sounds: ReplaySounds) -> None:
+        self.sounds = sounds
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def replay(path: str, realtime: bool = False, sounds: Optional[ReplaySounds] = None):
+    """Feeds a recording to CSGOState.update.
+
+    Returns the sounds stand-in (with the triggered categories), the time spent
+    in each update, in seconds, and the number of bodies that were not JSON (the
+    server answered them with a 400).
+    """
+    if sounds is None:
+        sounds = ReplaySounds()
+    state = CSGOState(ReplayClient(sounds), listen=False)
+
+    timings: List[float] = []
+    invalid = 0
+    first = None
+    start = time.perf_counter()
+    for timestamp, body in recording.read(path):
+        if first is None:
+            first = timestamp
+        sounds.timestamp = timestamp - first
+        if realtime:
+            delay = sounds.timestamp - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        before = time.perf_counter()
+        try:
+            state.update_raw(body)
+        except ValueError:
+            invalid = invalid + 1
+            continue
+        timings.append(time.perf_counter() - before)
+
+    return sounds, timings, invalid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recording")
+    parser.add_argument(
+        "--realtime", action="store_true", help="keep the original timing"
+    )
+    parser.add_argument(
+        "--all-categories",
+        action="store_true",
+        help="pretend every category has sounds instead of checking sounds/",
+    )
+    parser.add_argument("--quiet", action="store_true", help="only print stats")
+    args = parser.parse_args()
+
+    categories = None
+    if not args.all_categories and os.path.isdir("sounds"):
+        categories = set(file.category for file in library.scan().values())
+
+    sounds, timings, invalid = replay(
+        args.recording, args.realtime, ReplaySounds(categories)
+    )
+
+    if not args.quiet:
+        for timestamp, sound_name in sounds.played:
+            print(f"{timestamp:9.3f}s  {sound_name}")
+
+    total = sum(timings)
+    print(f"{len(timings)} updates, {len(sounds.played)} sounds triggered")
+    if invalid:
+        print(f"[!] {invalid} invalid updates skipped")
+    if timings:
+        print(
+            f"update : mean {total / len(timings) * 1e6:.1f}us, "
+            f"p50 {percentile(timings, 0.5) * 1e6:.1f}us, "
+            f"p99 {percentile(timings, 0.99) * 1e6:.1f}us, "
+            f"max {max(timings) * 1e6:.1f}us"
+        )
+        if total > 0:
+            print(f"throughput : {len(timings) / total:.0f} updates/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Declarative table of the events detected between two game states"""
+from typing import Callable, NamedTuple, Optional, Sequence, Tuple
+
+import config
+
+# A check receives (new_state, old_state) and returns the sound categories to try,
+# in order, or None if the rule doesn't apply.
+Check = Callable[..., Optional[Sequence[str]]]
+
+
+class Rule(NamedTuple):
+    name: str
+    # The rule is only evaluated when one of these PlayerState fields changed
+    triggers: Tuple[str, ...]
+    check: Check
+    # Only the first matching rule of a group plays (if/elif chain)
+    group: Optional[str] = None
+    # Rules for the local player only, not for spectated players
+    local_only: bool = False
+    # Skip the rule when the tracked player just changed
+    same_player: bool = True
+    # Other PlayerState fields the check reads
+    reads: Tuple[str, ...] = ()
+
+
+def timeout(new, old):
+    if new.phase == "freezetime" and new.play_timeout:
+        # One-shot : the timeout only plays once per call
+        new.play_timeout = False
+        return ("Timeout",)
+    return None
+
+
+def mvp(new, old):
+    return ("MVP",) if new.mvps == old.mvps + 1 else None
+
+
+def round_end(new, old):
+    if new.phase == "over" and new.mvps == old.mvps:
+        return ("Round win" if new.won_round else "Round lose",)
+    return None
+
+
+def round_start(new, old):
+    return ("Round start",) if new.phase == "live" else None
+
+
+def suicide(new, old):
+    if new.total_kills < old.total_kills and new.total_deaths == old.total_deaths + 1:
+        return ("Suicide",)
+    return None
+
+
+def teamkill(new, old):
+    if new.total_kills < old.total_kills and new.total_deaths == old.total_deaths:
+        return ("Teamkill",)
+    return None
+
+
+def death(new, old):
+    return ("Death",) if new.total_deaths == old.total_deaths + 1 else None
+
+
+def flashed(new, old):
+    if new.flash_opacity > 150 and new.flash_opacity > old.flash_opacity:
+        return ("Flashed",)
+    return None
+
+
+def knife_kill(new, old):
+    if new.round_kills == old.round_kills + 1 and new.is_knife_active:
+        return ("Unusual kill",)
+    return None
+
+
+def headshot(new, old):
+    if new.round_kills != old.round_kills + 1:
+        return None
+    if new.round_headshots != old.round_headshots + 1:
+        return None
+
+    # Prefer playing "Headshot" over "x kills"
+    if config.settings.prefer_headshots:
+        return ("Headshot",)
+    return (f"{new.round_kills} kills", "Headshot")
+
+
+def kill(new, old):
+    if new.round_kills == old.round_kills + 1:
+        return (f"{new.round_kills} kills",)
+    return None
+
+
+def collateral(new, old):
+    # Player killed multiple players
+    return ("Collateral",) if new.round_kills > old.round_kills else None
+
+
+RULES = (
+    Rule("Timeout", ("phase", "play_timeout"), timeout, same_player=False),
+    # Round start, win, lose, MVP
+    Rule("MVP", ("mvps",), mvp, group="round", local_only=True),
+    Rule(
+        "Round end",
+        ("phase",),
+        round_end,
+        group="round",
+        reads=("mvps", "won_round"),
+    ),
+    Rule("Round start", ("phase",), round_start, group="round"),
+    # Lost kills - either teamkilled or suicided
+    Rule(
+        "Suicide",
+        ("total_kills",),
+        suicide,
+        group="death",
+        local_only=True,
+        reads=("total_deaths",),
+    ),
+    Rule(
+        "Teamkill",
+        ("total_kills",),
+        teamkill,
+        group="death",
+        local_only=True,
+        reads=("total_deaths",),
+    ),
+    # Didn't suicide or teamkill -> check if player just died
+    Rule("Death", ("total_deaths",), death, group="death", local_only=True),
+    Rule("Flashed", ("flash_opacity",), flashed, local_only=True),
+    # Kill with knife equipped, then with weapon equipped
+    Rule(
+        "Knife kill",
+        ("round_kills",),
+        knife_kill,
+        group="kill",
+        local_only=True,
+        reads=("is_knife_active",),
+    ),
+    Rule(
+        "Headshot",
+        ("round_kills",),
+        headshot,
+        group="kill",
+        local_only=True,
+        reads=("round_headshots",),
+    ),
+    Rule("Kill", ("round_kills",), kill, group="kill", local_only=True),
+    Rule("Collateral", ("round_kills",), collateral, group="kill", local_only=True),
+)
+
+
+# Categories worth loading ahead of time, by round phase (for lazy loading)
+PHASE_PREFETCH = {
+    "freezetime": ("Round start", "Timeout"),
+    "live": ("Headshot", "Death", "Flashed", "Round win", "Round lose", "MVP"),
+    "over": ("Round start",),
+}
+
+
+def prefetches(new, old) -> Tuple[str, ...]:
+    """Returns the categories that will probably be played soon after new."""
+    if not new.valid:
+        return ()
+    if old is not None and old.valid:
+        if new.round_kills == old.round_kills and new.phase == old.phase:
+            return ()
+    return PHASE_PREFETCH.get(new.phase, ()) + (f"{new.round_kills + 1} kills",)
+
+
+class RuleEngine:
+    """Runs the rules whose trigger fields changed between two states."""
+
+    def __init__(self, rules: Sequence[Rule] = RULES) -> None:
+        self.rules = tuple(rules)
+        self.fields: Tuple[str, ...] = tuple(
+            sorted(set(field for rule in self.rules for field in rule.triggers))
+        )
+        bits = {field: 1 << i for i, field in enumerate(self.fields)}
+        self.masks = tuple(
+            sum(bits[field] for field in set(rule.triggers)) for rule in self.rules
+        )
+
+    def changes(self, new, old) -> int:
+        """Returns a bitmask of the trigger fields that changed."""
+        changed = 0
+        for i, field in enumerate(self.fields):
+            if getattr(new, field) != getattr(old, field):
+                changed |= 1 << i
+        return changed
+
+    def run(self, new, old, post: Callable[[Sequence[str]], None]) -> None:
+        """Posts the sound categories of every event, in rule order.
+
+        Each event is a sequence of categories : the first one that has sounds
+        gets played.
+        """
+        changed = self.changes(new, old)
+        if not changed:
+            return
+
+        same_player = new.playerid == old.playerid
+        fired = set()
+        for rule, mask in zip(self.rules, self.masks):
+            if not mask & changed or rule.group in fired:
+                continue
+            if rule.local_only and not new.is_local_player:
+                continue
+            if rule.same_player and not same_player:
+                continue
+
+            categories = rule.check(new, old)
+            if not categories:
+                continue
+            if rule.group is not None:
+                fired.add(rule.group)
+            post(categories)
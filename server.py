@@ -0,0 +1,202 @@
+"""Minimal asyncio HTTP/1.1 server receiving Gamestate Integration POSTs"""
+import asyncio
+import ipaddress
+import time
+from typing import Callable, Dict, Optional
+
+import gsi
+from metrics import metrics
+
+# CS:GO sends small headers and bodies of a few KB. Anything bigger is rejected
+# instead of being buffered.
+MAX_HEADER_SIZE = 8 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+
+# CS:GO sends a heartbeat every 60 seconds, keep idle connections a bit longer
+KEEPALIVE_TIMEOUT = 90.0
+
+RESPONSES = {
+    200: b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n",
+    400: (
+        b"HTTP/1.1 400 Bad Request\r\n"
+        b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+    ),
+    403: b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n",
+    404: b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n",
+    405: (
+        b"HTTP/1.1 405 Method Not Allowed\r\n"
+        b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+    ),
+    411: (
+        b"HTTP/1.1 411 Length Required\r\n"
+        b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+    ),
+    413: (
+        b"HTTP/1.1 413 Payload Too Large\r\n"
+        b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+    ),
+    431: (
+        b"HTTP/1.1 431 Request Header Fields Too Large\r\n"
+        b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+    ),
+}
+
+
+class PostHandler:
+    """Handles a single (keep-alive) connection from the game client.
+
+    Payloads are handed to the state machine directly on the event loop, there is
+    no thread hop between receiving a POST and playing a sound.
+    """
+
+    def __init__(self, state, reader, writer, recorder=None, routes=None) -> None:
+        self.state = state
+        self.reader = reader
+        self.writer = writer
+        self.recorder = recorder
+        # Dict[path:Callable returning a JSON body], for read-only GET requests
+        self.routes: Dict[str, Callable[[], bytes]] = routes or {}
+
+    async def read_request(self):
+        """Returns (method, path, headers, body, received), or None if the connection
+        should close. received is the monotonic time the headers were read at."""
+        try:
+            head = await asyncio.wait_for(
+                self.reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT
+            )
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            self.writer.write(RESPONSES[431])
+            return None
+        received = time.monotonic()
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, path, version = lines[0].split(" ", 2)
+        except ValueError:
+            self.writer.write(RESPONSES[400])
+            return None
+
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if (
+            version == "HTTP/1.0"
+            and headers.get("connection", "").lower() != "keep-alive"
+        ):
+            headers["connection"] = "close"
+
+        if method == "GET":
+            return method, path, headers, b"", received
+        if method != "POST":
+            self.writer.write(RESPONSES[405])
+            return None
+
+        try:
+            content_len = int(headers["content-length"])
+        except (KeyError, ValueError):
+            self.writer.write(RESPONSES[411])
+            return None
+        if content_len < 0 or content_len > MAX_BODY_SIZE:
+            self.writer.write(RESPONSES[413])
+            return None
+
+        try:
+            body = await self.reader.readexactly(content_len)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+        return method, path, headers, body, received
+
+    def is_local(self) -> bool:
+        """Returns True if the peer is on this machine. The game client may post
+        from the network (e.g. LAN setups), but the GET routes reveal internals
+        and start profiles, so they are for local tools only."""
+        peer = self.writer.get_extra_info("peername")
+        if not peer:
+            return False
+        try:
+            address = ipaddress.ip_address(peer[0].split("%", 1)[0])
+        except (ValueError, IndexError, AttributeError):
+            return False
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        return address.is_loopback
+
+    def respond_get(self, path: str) -> None:
+        route = self.routes.get(path)
+        if route is None:
+            self.writer.write(RESPONSES[404])
+            return
+        if not self.is_local():
+            self.writer.write(RESPONSES[403])
+            return
+        content = route()
+        self.writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            b"Content-Length: %d\r\n\r\n" % len(content)
+        )
+        self.writer.write(content)
+
+    async def handle(self) -> None:
+        try:
+            while True:
+                request = await self.read_request()
+                if request is None:
+                    break
+                method, path, headers, body, received = request
+                if method == "GET":
+                    self.respond_get(path)
+                    await self.writer.drain()
+                    if headers.get("connection", "").lower() == "close":
+                        break
+                    continue
+
+                if self.recorder is not None:
+                    self.recorder.write(body)
+
+                decode_start = time.monotonic()
+                metrics.record("receive", decode_start - received)
+                try:
+                    payload = gsi.loads(body)
+                except ValueError:
+                    self.writer.write(RESPONSES[400])
+                    break
+                metrics.record("decode", time.monotonic() - decode_start)
+
+                # Answer first so the game client isn't waiting on our processing
+                self.writer.write(RESPONSES[200])
+                self.state.update(payload, received)
+                await self.writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        finally:
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                pass
+            self.writer.close()
+
+
+async def serve(
+    state,
+    host: str = "127.0.0.1",
+    port: int = 3000,
+    recorder=None,
+    routes: Optional[Dict[str, Callable[[], bytes]]] = None,
+):
+    """Starts listening for Gamestate Integration POSTs on the running loop.
+
+    If a recorder is given, every received body is appended to it.
+    routes maps paths to read-only GET endpoints, e.g. /metrics.
+    """
+
+    async def on_connect(reader, writer):
+        await PostHandler(state, reader, writer, recorder, routes).handle()
+
+    return await asyncio.start_server(on_connect, host, port, limit=MAX_HEADER_SIZE)
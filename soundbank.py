@@ -0,0 +1,145 @@
+"""Packed sound bank : every sound of the sounds directory, decoded into one file.
+
+Usage : python soundbank.py [--output sounds.bank] [--workers N]
+
+The bank starts with a header mapping each sound file to its category, format
+and the offset and length of its samples, followed by the raw 16-bit PCM.
+At runtime it is memory-mapped, and OpenAL buffers are filled straight from the
+mapping. The sounds directory stays the editable source : files that changed
+since the bank was built are decoded as usual.
+"""
+import argparse
+import ctypes
+import json
+import mmap
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import library
+from soundcache import PCM, decode, hash_file
+
+BANK_FILE = "sounds.bank"
+MAGIC = b"CQSB"
+VERSION = 1
+# Magic, version, header length
+PREAMBLE = struct.Struct("<4sII")
+# Samples are aligned so they can be read as 16-bit integers
+ALIGNMENT = 16
+
+
+def key(filepath: str) -> str:
+    """Bank keys use forward slashes, so a bank built on linux works on windows."""
+    return filepath.replace(os.sep, "/")
+
+
+def build(
+    directory: str = library.SOUNDS_DIR,
+    output: str = BANK_FILE,
+    workers: Optional[int] = None,
+) -> int:
+    """Decodes every sound of directory into a bank. Returns the number of sounds.
+
+    Decoding happens in a process pool of workers processes (one per core by
+    default). With workers=1, everything is decoded in this process.
+    """
+    index = library.scan(directory)
+    paths = sorted(index)
+    if workers == 1:
+        decoded = [decode(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            decoded = list(executor.map(decode, paths, chunksize=4))
+
+    entries: Dict[str, dict] = {}
+    offset = 0
+    for path, pcm in zip(paths, decoded):
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        entries[key(path)] = {
+            "category": index[path].category,
+            "size": index[path].size,
+            "mtime": index[path].mtime,
+            "hash": hash_file(path),
+            "offset": offset,
+            "length": len(pcm.data),
+            "channels": pcm.channels,
+            "frequency": pcm.frequency,
+        }
+        offset = offset + len(pcm.data)
+
+    header = json.dumps({"files": entries}).encode()
+    # Samples start on an aligned offset too
+    data_start = -(-(PREAMBLE.size + len(header)) // ALIGNMENT) * ALIGNMENT
+    header = header.ljust(data_start - PREAMBLE.size, b" ")
+
+    with open(output + ".tmp", "wb") as outfile:
+        outfile.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        outfile.write(header)
+        for path, pcm in zip(paths, decoded):
+            entry = entries[key(path)]
+            outfile.seek(data_start + entry["offset"])
+            outfile.write(pcm.data)
+    os.replace(output + ".tmp", output)
+    return len(paths)
+
+
+class SoundBank:
+    """Read-only view of a bank file, memory-mapped."""
+
+    def __init__(self, path: str = BANK_FILE) -> None:
+        with open(path, "rb") as infile:
+            magic, version, header_length = PREAMBLE.unpack(
+                infile.read(PREAMBLE.size)
+            )
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} sound bank")
+            self.entries: Dict[str, dict] = json.loads(infile.read(header_length))[
+                "files"
+            ]
+            self.data_start = PREAMBLE.size + header_length
+            # Copy-on-write, so ctypes can point into the mapping. Nothing writes
+            # to it, so pages are shared with the file cache.
+            self.mapping = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    def get(self, filepath: str) -> Optional[PCM]:
+        """Returns the samples of a file, if the bank has them for its current
+        content. The samples point into the mapping, they are not copied."""
+        entry = self.entries.get(key(filepath))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        if stat.st_size != entry["size"]:
+            return None
+        # Copying the sounds around (e.g. when packaging) changes their mtime
+        if stat.st_mtime_ns != entry["mtime"] and hash_file(filepath) != entry["hash"]:
+            return None
+
+        data = (ctypes.c_char * entry["length"]).from_buffer(
+            self.mapping, self.data_start + entry["offset"]
+        )
+        return PCM(data, entry["channels"], entry["frequency"])
+
+
+def open_bank(path: str = BANK_FILE) -> Optional[SoundBank]:
+    """Returns the sound bank, or None if there is no usable one."""
+    try:
+        return SoundBank(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as err:
+        print(f"[!] Ignoring sound bank {path} : {err}")
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the packed sound bank.")
+    parser.add_argument("--directory", default=library.SOUNDS_DIR)
+    parser.add_argument("--output", default=BANK_FILE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    nb_sounds = build(args.directory, args.output, args.workers)
+    print(f"[*] {nb_sounds} sounds written to {args.output}")
@@ -0,0 +1,174 @@
+"""On-disk cache of decoded PCM samples"""
+import ctypes
+import hashlib
+import json
+import os
+from openal import (  # type: ignore
+    AL_FORMAT_MONO16,
+    AL_FORMAT_STEREO16,
+    Buffer,
+    OpusFile,
+)
+from threading import Lock
+from typing import Any, Collection, Dict, NamedTuple, Optional, Tuple
+
+CACHE_DIR = os.path.join("cache", "pcm")
+INDEX_FILE = "index.json"
+
+
+class PCM(NamedTuple):
+    """Decoded 16-bit PCM samples"""
+
+    # bytes, or a ctypes array pointing into a sound bank
+    data: Any
+    channels: int
+    frequency: int
+
+    def to_buffer(self) -> Buffer:
+        format = AL_FORMAT_MONO16 if self.channels == 1 else AL_FORMAT_STEREO16
+        return Buffer(self.data, len(self.data), format, self.frequency)
+
+
+def decode(filepath: str) -> PCM:
+    """Decodes an opus file."""
+    file = OpusFile(filepath)
+    data = ctypes.string_at(file.buffer, file.buffer_length)
+    return PCM(data, file.channels, file.frequency)
+
+
+def hash_file(filepath: str) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    with open(filepath, "rb") as infile:
+        for chunk in iter(lambda: infile.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PCMCache:
+    """Decoded PCM samples stored on disk, keyed by file path, size, mtime and hash.
+
+    A file whose path, size and mtime didn't change is loaded without being read
+    nor hashed. Otherwise it is hashed, and only decoded if no samples are cached
+    for that content.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR) -> None:
+        self.directory = directory
+        self.lock = Lock()
+        self.dirty = False
+        # Dict[filepath:entry]
+        self.index: Dict[str, dict] = {}
+        try:
+            with open(os.path.join(directory, INDEX_FILE)) as infile:
+                self.index = json.load(infile)
+        except (OSError, ValueError):
+            pass
+
+    def _read(self, entry: dict) -> Optional[PCM]:
+        try:
+            with open(os.path.join(self.directory, entry["hash"] + ".pcm"), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) != entry["length"]:
+            return None
+        return PCM(data, entry["channels"], entry["frequency"])
+
+    def lookup(self, filepath: str) -> Tuple[Optional[PCM], dict]:
+        """Returns the cached samples of a file, or None and the entry to store()
+        once it is decoded."""
+        stat = os.stat(filepath)
+        with self.lock:
+            entry = self.index.get(filepath)
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime_ns
+        ):
+            pcm = self._read(entry)
+            if pcm is not None:
+                return pcm, entry
+
+        # File changed (or was never seen) : check if we already have its content
+        content_hash = hash_file(filepath)
+        with self.lock:
+            for candidate in self.index.values():
+                if candidate["hash"] == content_hash:
+                    entry = dict(candidate, size=stat.st_size, mtime=stat.st_mtime_ns)
+                    break
+            else:
+                entry = None
+        pcm = self._read(entry) if entry is not None else None
+        if pcm is None:
+            return None, {
+                "hash": content_hash,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+            }
+
+        with self.lock:
+            self.index[filepath] = entry
+            self.dirty = True
+        return pcm, entry
+
+    def store(self, filepath: str, entry: dict, pcm: PCM) -> None:
+        """Caches the decoded samples of a file, with the entry lookup() returned."""
+        entry = dict(
+            entry,
+            length=len(pcm.data),
+            channels=pcm.channels,
+            frequency=pcm.frequency,
+        )
+        self._write(entry, pcm)
+        with self.lock:
+            self.index[filepath] = entry
+            self.dirty = True
+
+    def get(self, filepath: str) -> PCM:
+        """Returns the decoded samples of a file, decoding it only if needed."""
+        pcm, entry = self.lookup(filepath)
+        if pcm is None:
+            pcm = decode(filepath)
+            self.store(filepath, entry, pcm)
+        return pcm
+
+    def _write(self, entry: dict, pcm: PCM) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, entry["hash"] + ".pcm")
+            with open(path + ".tmp", "wb") as outfile:
+                outfile.write(pcm.data)
+            os.replace(path + ".tmp", path)
+        except OSError as err:
+            print(f"[!] Could not cache decoded samples : {err}")
+
+    def save(self, alive: Collection[str]) -> None:
+        """Writes the index, forgetting files that are not in alive anymore, and
+        removes samples no file refers to.
+
+        alive must be every file of the library, not just the ones loaded : the
+        others keep their samples for the next launch, or for buffers that get
+        evicted.
+        """
+        with self.lock:
+            removed = [filepath for filepath in self.index if filepath not in alive]
+            if not self.dirty and not removed:
+                return
+            for filepath in removed:
+                del self.index[filepath]
+            self.dirty = False
+            index = dict(self.index)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, INDEX_FILE)
+            with open(path + ".tmp", "w") as outfile:
+                json.dump(index, outfile)
+            os.replace(path + ".tmp", path)
+
+            hashes = set(entry["hash"] + ".pcm" for entry in index.values())
+            for file in os.listdir(self.directory):
+                if file.endswith(".pcm") and file not in hashes:
+                    os.remove(os.path.join(self.directory, file))
+        except OSError as err:
+            print(f"[!] Could not save sound cache index : {err}")
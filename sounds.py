@@ -1,107 +1,390 @@
 """Related to sounds"""
 import asyncio
-import os
 import random
-import wx  # type: ignore
-from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
-from openal import AL_PLAYING, PYOGG_AVAIL, Buffer, OpusFile, Source  # type: ignore
+from openal import PYOGG_AVAIL, Buffer  # type: ignore
 from threading import Lock
-from typing import Dict, List
-from wxasync import StartCoroutine  # type: ignore
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import config
+import library
+from buffers import BufferCache, destroy
+from decoder import Batch, DecodeEngine
+from events import EventPipeline
+from metrics import metrics
+from soundbank import open_bank
+from soundcache import PCM, PCMCache
+from voices import DEFAULT_PRIORITY, PRIORITIES, VoicePool
 
 
 class SoundManager:
     """Loads and plays sounds"""
 
     def __init__(self, client) -> None:
-        self.playerid = None
         self.client = client
         self.lock = Lock()
         self.nb_max_sounds = 0
+        self.nb_loaded = 0
+        self.nb_to_load = 0
+        self.cache = PCMCache()
+        # Prebuilt by build.py, checked before the cache
+        self.bank = open_bank()
 
-        # Dict[category:List[sound_data]]
-        self.loaded_sounds: Dict[str, List[Buffer]] = defaultdict(list)
+        # Dict[filepath:SoundFile], as of the last reload
+        self.index: Dict[str, library.SoundFile] = {}
+        # Dict[category:List[filepath]] of the files ready to play
+        # Lists are never modified in place, but swapped when a category changes.
+        self.loaded_sounds: Dict[str, List[str]] = {}
 
-        self.volume: int = config.config["Sounds"].getint("Volume", 50)  # type: ignore
+        self.reloading = asyncio.Lock()
+        self.watcher = None
+        # Threads for cache lookups, worker processes for decoding
+        self.executor = ThreadPoolExecutor()
+        self.decoder = DecodeEngine()
 
-    def max_sounds(self) -> int:
-        """Returns the number of sounds that will be loaded."""
-        max = 0
-        for path in os.listdir("sounds"):
-            for file in os.listdir(os.path.join("sounds", path)):
-                if file.startswith(".git") or file == "desktop.ini":
-                    continue
-                max = max + 1
-        return max
+        # In lazy mode, categories are only loaded on first use, when the gamestate
+        # suggests they will be needed soon, or in the background after startup.
+        self.lazy = config.settings.lazy_loading
+        # Dict[category:Future], categories currently being loaded in lazy mode
+        self.loading: Dict[str, asyncio.Future] = {}
+        # Dict[filepath:Future], evicted files being loaded again
+        self.restoring: Dict[str, asyncio.Future] = {}
+        self.warmup = None
+
+        self.voices = VoicePool(config.settings.max_voices)
+        # Evicted buffers are loaded again from the bank or the cache when played
+        self.buffers = BufferCache(self.budget(), self.voices.in_use)
+        config.settings.subscribe("buffer_budget_mb", self.set_budget)
+
+        # Events detected by the gamestate, played from the event loop
+        self.pipeline = EventPipeline(
+            asyncio.get_event_loop(),
+            self.play,
+            lambda sound_name: PRIORITIES.get(sound_name, DEFAULT_PRIORITY),
+            lambda: not self.voices.playing,
+            policy=config.settings.event_policy,
+            stale_ms=config.settings.stale_event_ms,
+            max_backlog=config.settings.max_backlog,
+        )
+        self.voices.on_idle = self.pipeline.dispatch
+        self.set_latency_status(config.settings.latency_status)
+        config.settings.subscribe("event_policy", self.pipeline.set_policy)
+        for name in ("stale_event_ms", "max_backlog"):
+            config.settings.subscribe(name, self.set_pipeline_limits)
+        config.settings.subscribe("latency_status", self.set_latency_status)
+
+    @staticmethod
+    def budget() -> int:
+        return int(config.settings.buffer_budget_mb * 1024 * 1024)
+
+    def set_budget(self, _) -> None:
+        self.buffers.budget = self.budget()
+        self.buffers.trim()
+
+    def set_pipeline_limits(self, _) -> None:
+        self.pipeline.set_limits(
+            config.settings.stale_event_ms, config.settings.max_backlog
+        )
+
+    def set_latency_status(self, enabled: bool) -> None:
+        if enabled:
+            self.pipeline.on_played = lambda: self.client.status(metrics.status_text())
+        else:
+            self.pipeline.on_played = None
+
+    def lookup(self, filepath: str) -> Tuple[Optional[PCM], Optional[dict]]:
+        """Returns already decoded samples from the bank or the cache, or None and
+        the cache entry to store once decoded."""
+        pcm = self.bank.get(filepath) if self.bank is not None else None
+        if pcm is not None:
+            return pcm, None
+        return self.cache.lookup(filepath)
+
+    def load_from_bank(self, filepath: str) -> bool:
+        """Loads a single file if the bank has it, in this thread. Samples are
+        mapped, so this is cheap enough for the event loop."""
+        if not PYOGG_AVAIL or self.bank is None:
+            return False
+
+        try:
+            pcm = self.bank.get(filepath)
+        except OSError:
+            pcm = None
+        if pcm is None:
+            return False
+        destroy([self.buffers.put(filepath, pcm.to_buffer(), len(pcm.data))])
+        return True
+
+    def progress(self, count: int) -> None:
+        """Counts loaded files. Called for every file, shown a few times a second."""
+        with self.lock:
+            self.nb_loaded = self.nb_loaded + count
+            nb_loaded = self.nb_loaded
+        percent = nb_loaded * 100 // self.nb_to_load if self.nb_to_load else 100
+        self.client.status(
+            f"Loading sounds... {nb_loaded}/{self.nb_to_load} files ({percent}%)"
+        )
+
+    async def load_files(self, filepaths: List[str], report: bool = True) -> None:
+        """Loads files into self.buffers.
 
-    def load(self, category: str, filepath: str) -> None:
+        Files that are in the bank or the cache are read in threads, the others
+        are decoded in worker processes. OpenAL buffers are then created in a
+        single batch.
+        """
         # Can't load files - TODO show error & quit
-        if not PYOGG_AVAIL:
+        if not PYOGG_AVAIL or not filepaths:
             return
 
-        with self.lock:
-            self.loaded_sounds[category].append(Buffer(OpusFile(filepath)))
-            wx.CallAfter(
-                self.client.gui.SetStatusText,
-                f"Loading sounds... ({len(self.loaded_sounds)}/{self.nb_max_sounds})",
+        loop = asyncio.get_running_loop()
+        found = await asyncio.gather(
+            *[
+                loop.run_in_executor(self.executor, self.lookup, filepath)
+                for filepath in filepaths
+            ]
+        )
+        cached: Dict[str, PCM] = {}
+        # Dict[filepath:cache entry]
+        missing: Dict[str, dict] = {}
+        for filepath, (pcm, entry) in zip(filepaths, found):
+            if pcm is not None:
+                cached[filepath] = pcm
+            else:
+                missing[filepath] = entry
+        del found
+        if report:
+            self.progress(len(cached))
+
+        batch = Batch()
+        try:
+            if missing:
+                batch = await self.decoder.decode(
+                    list(missing), (lambda _: self.progress(1)) if report else None
+                )
+            await loop.run_in_executor(
+                self.executor, self.create_buffers, cached, batch, missing
             )
+        finally:
+            batch.close()
+
+    def create_buffers(
+        self, cached: Dict[str, PCM], batch: Batch, missing: Dict[str, dict]
+    ) -> None:
+        """Caches the decoded samples, then creates all OpenAL buffers at once."""
+        for filepath, pcm in batch.pcms.items():
+            self.cache.store(filepath, missing[filepath], pcm)
+        buffers = {
+            filepath: (pcm.to_buffer(), len(pcm.data)) for filepath, pcm in cached.items()
+        }
+        buffers.update(
+            (filepath, (pcm.to_buffer(), len(pcm.data)))
+            for filepath, pcm in batch.pcms.items()
+        )
+        # Replaced buffers belong to files that changed
+        destroy([self.buffers.put(path, *buffer) for path, buffer in buffers.items()])
 
     async def reload(self) -> None:
-        """Reloads the list of available sounds.
+        """Reloads the sounds that changed since the last reload.
 
         The async logic is a bit complicated here, but it boils down to the following :
-        - No more than 5 sounds will be loaded at the same time
-        - Every sound is getting loaded in a separate thread, so the GUI is not blocked
-        - We're not waiting using the executor but by waiting for all tasks to end,
+        - Only added or modified files are decoded, the others keep their buffers
+        - Files are decoded in worker processes, one per core, so the GUI is not
+        blocked and decoding really runs in parallel
+        - We're not waiting using the executors but by waiting for all tasks to end,
         so the operation stays asynchronous
+        - Categories are swapped in once all their files are loaded, so play() never
+        sees an empty category while reloading
         """
+        async with self.reloading:
+            loop = asyncio.get_running_loop()
+            index = await loop.run_in_executor(None, library.scan)
+            changes = library.diff(self.index, index)
+            if changes:
+                await self.apply(index, changes)
+            self.nb_max_sounds = len(index)
+
+        self.client.status(self.loaded_text())
+
+        if self.watcher is None:
+            self.watcher = asyncio.ensure_future(self.watch())
+        if self.lazy and self.warmup is None:
+            self.warmup = asyncio.ensure_future(self.warm_up())
+
+    def loaded_text(self) -> str:
+        """Result of the last reload, for the status bar."""
+        if self.lazy:
+            return f"{self.nb_max_sounds} sounds found."
+        return f"{self.nb_max_sounds} sounds loaded."
+
+    async def apply(
+        self, index: Dict[str, library.SoundFile], changes: library.Changes
+    ) -> None:
+        """Loads the changed files and swaps in the categories they belong to.
+
+        In lazy mode, only categories that were already loaded are reloaded.
+        """
+        to_load = [
+            path
+            for path in changes.added + changes.changed
+            if not self.lazy or index[path].category in self.loaded_sounds
+        ]
         with self.lock:
-            self.loaded_sounds = defaultdict(list)
-            self.nb_max_sounds = self.max_sounds()
+            self.nb_loaded = 0
+            self.nb_to_load = len(to_load)
 
-        executor = ThreadPoolExecutor(max_workers=5)
         loop = asyncio.get_running_loop()
-        tasks: List = []
-        for category in os.listdir("sounds"):
-            for file in os.listdir(os.path.join("sounds", category)):
-                if file.startswith(".git") or file == "desktop.ini":
-                    continue
+        await self.load_files(to_load)
+        # With the whole library, not just what was loaded : unchanged files keep
+        # their cached samples
+        await loop.run_in_executor(None, self.cache.save, index)
 
-                filepath = os.path.join("sounds", category, file)
-                tasks.append(
-                    loop.run_in_executor(executor, self.load, category, filepath)
+        old_index = self.index
+        with self.lock:
+            retired = [self.buffers.pop(path) for path in changes.removed]
+            for category in changes.categories(old_index, index):
+                if self.lazy and category not in self.loaded_sounds:
+                    continue
+                self.swap(
+                    category,
+                    [path for path, file in index.items() if file.category == category],
                 )
-        executor.shutdown(wait=False)
-        await asyncio.gather(*tasks)
-        wx.CallAfter(
-            self.client.gui.SetStatusText, f"{self.nb_max_sounds} sounds loaded.",
+            self.index = index
+
+        destroy(retired)
+        self.buffers.trim()
+
+    async def watch(self, interval: float = 2.0) -> None:
+        """Reloads sounds whenever files change in the sounds directory."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            if self.reloading.locked():
+                continue
+            try:
+                index = await loop.run_in_executor(None, library.scan)
+                if library.diff(self.index, index):
+                    await self.reload()
+            except Exception as err:
+                # Keep watching : the next change may fix it
+                print(f"[!] Could not reload sounds : {err}")
+
+    def swap(self, category: str, files: List[str]) -> None:
+        """Swaps in the files of a category that were loaded."""
+        ready = [path for path in files if path in self.buffers.loaded]
+        self.buffers.pin(category, ready)
+        self.loaded_sounds[category] = ready
+
+    def files(self, category: str) -> List[str]:
+        return [path for path, file in self.index.items() if file.category == category]
+
+    async def load_category(self, category: str) -> None:
+        """Loads every file of a category, then swaps the category in."""
+        try:
+            files = self.files(category)
+            await self.load_files(
+                [path for path in files if path not in self.buffers], report=False
+            )
+            with self.lock:
+                self.swap(category, files)
+            self.buffers.trim()
+        finally:
+            del self.loading[category]
+
+    def prefetch(self, category: str) -> None:
+        """Starts loading a category in the background, if it isn't loaded yet."""
+        if not self.lazy or category in self.loaded_sounds or category in self.loading:
+            return
+        if not any(file.category == category for file in self.index.values()):
+            return
+        self.loading[category] = asyncio.ensure_future(self.load_category(category))
+
+    async def warm_up(self) -> None:
+        """Loads the remaining categories one by one, most important first."""
+        categories = set(file.category for file in self.index.values())
+        for category in sorted(
+            categories, key=lambda c: -PRIORITIES.get(c, DEFAULT_PRIORITY)
+        ):
+            self.prefetch(category)
+            if category in self.loading:
+                await asyncio.shield(self.loading[category])
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.cache.save, self.index
         )
 
-    async def _play(self, sound) -> None:
-        """Play sound from its file path."""
-        sound = Source(sound)
+    def _play(self, sound: Buffer, sound_name: str) -> bool:
+        """Play a loaded sound on a pooled voice."""
         # gain can be between 0.0 and 2.0 with the GUI's volume slider
-        gain: float = 0.0 if self.volume == 0 else self.volume / 50.0
-        sound.set_gain(gain)
-        sound.play()
+        volume = config.settings.volume
+        gain: float = 0.0 if volume == 0 else volume / 50.0
+        priority = PRIORITIES.get(sound_name, DEFAULT_PRIORITY)
+        if not self.voices.play(sound, gain, priority):
+            print(f"[!] No voice available for '{sound_name}'.")
+            return False
+        return True
 
-        while sound.get_state() == AL_PLAYING:
-            # Don't end the thread until the sound finished playing
-            await asyncio.sleep(1)
+    def post(self, sound_names: Sequence[str], received: Optional[float] = None) -> None:
+        """Queues an event from any thread. The first sound of sound_names that can
+        be played will be, from the event loop."""
+        self.pipeline.post(sound_names, received)
 
     def play(self, sound_name: str) -> bool:
         """Tries playing a sound by its name.
 
         Returns True if the sound was played successfully.
         """
-        with self.lock:
-            if len(self.loaded_sounds[sound_name]) > 0:
-                sound = random.choice(self.loaded_sounds[sound_name])
-                StartCoroutine(self._play(sound), self.client.gui)
-                return True
-            else:
+        # No lock : category lists are swapped, never modified in place
+        files = self.loaded_sounds.get(sound_name)
+        if not files and self.lazy and sound_name not in self.loaded_sounds:
+            # First use of a category that wasn't prefetched : the category loads
+            # in the background. Meanwhile, play a variant if the bank has it ;
+            # decoding or reading the cache here would block gamestates and the GUI.
+            files = self.files(sound_name)
+            if not files:
                 print(f"[!] No sound found for '{sound_name}'.")
                 return False
+            path = random.choice(files)
+            self.prefetch(sound_name)
+            if path not in self.buffers and not self.load_from_bank(path):
+                print(f"[!] Sounds for '{sound_name}' are still loading.")
+                return False
+            files = [path]
+
+        if not files:
+            print(f"[!] No sound found for '{sound_name}'.")
+            return False
+
+        path = random.choice(files)
+        buffer = self.buffers.get(path)
+        if buffer is not None:
+            return self._play(buffer, sound_name)
+
+        buffer = self.restore(path, sound_name)
+        if buffer is None:
+            print(f"[!] No sound ready for '{sound_name}'.")
+            return False
+        played = self._play(buffer, sound_name)
+        # Once playing, so the restored buffer can't be the one evicted
+        self.buffers.trim()
+        return played
+
+    def restore(self, filepath: str, category: str) -> Optional[Buffer]:
+        """Returns a buffer for an evicted file.
+
+        Samples mapped from the bank are used right away. Otherwise the file is
+        read from the cache or decoded again in the background, and the pinned
+        variant of the category plays instead : evicted files are the long ones,
+        reading them here would block gamestates and the GUI.
+        """
+        if self.load_from_bank(filepath):
+            return self.buffers.get(filepath)
+        if filepath not in self.restoring:
+            self.restoring[filepath] = asyncio.ensure_future(self.reload_file(filepath))
+        return self.buffers.hot(category)
+
+    async def reload_file(self, filepath: str) -> None:
+        """Loads an evicted file again."""
+        try:
+            await self.load_files([filepath], report=False)
+            self.buffers.trim()
+        finally:
+            del self.restoring[filepath]
@@ -1,89 +1,164 @@
 """Related to CSGO Gamestate"""
+import asyncio
 import json
-from threading import Lock, Thread
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import time
+from typing import Dict, List, Optional, Set
 
 import config
+import gsi
+import server
+from gsi import Gamestate, SchemaError
+from metrics import metrics
+from profiling import KINDS, profiler
+from recording import Recorder
+from rules import RULES, RuleEngine, prefetches
+
+engine = RuleEngine()
+
+# Gamestate integration component providing each PlayerState field
+COMPONENTS = {
+    "steamid": "provider",
+    "playerid": "player_id",
+    "is_local_player": "player_id",
+    "is_ingame": "player_id",
+    "current_round": "map",
+    "remaining_timeouts": "map",
+    "play_timeout": "map",
+    "phase": "round",
+    "won_round": "round",
+    "flash_opacity": "player_state",
+    "round_kills": "player_state",
+    "round_headshots": "player_state",
+    "is_knife_active": "player_weapons",
+    "mvps": "player_match_stats",
+    "total_deaths": "player_match_stats",
+    "total_kills": "player_match_stats",
+}
+# Gamestate attributes each PlayerState field is computed from
+ATTRIBUTES = {
+    "steamid": ("steamid",),
+    "playerid": ("playerid",),
+    "is_local_player": ("steamid", "playerid"),
+    "is_ingame": ("in_menu",),
+    "current_round": ("current_round",),
+    "remaining_timeouts": ("ct_timeouts", "t_timeouts"),
+    "play_timeout": ("ct_timeouts", "t_timeouts", "phase"),
+    "phase": ("phase",),
+    "won_round": ("phase", "team", "win_team"),
+    "flash_opacity": ("flashed",),
+    "round_kills": ("round_kills",),
+    "round_headshots": ("round_killhs",),
+    "is_knife_active": ("knife_active",),
+    "mvps": ("mvps",),
+    "total_deaths": ("deaths",),
+    "total_kills": ("kills",),
+}
+# Fields PlayerState and compare() need whatever the rules are
+BASE_FIELDS = (
+    "steamid",
+    "playerid",
+    "is_ingame",
+    "current_round",
+    "remaining_timeouts",
+    "phase",
+    "round_kills",
+    "total_kills",
+)
+
+
+def used_fields(rules=RULES) -> Set[str]:
+    """Returns the PlayerState fields that rules and compare() read."""
+    fields = set(BASE_FIELDS)
+    for rule in rules:
+        fields.update(rule.triggers + rule.reads)
+    return fields
+
+
+def subscriptions(rules=RULES) -> List[str]:
+    """Returns the components the gamestate integration cfg must ask for."""
+    components = set(COMPONENTS[field] for field in used_fields(rules))
+    # In the order CS:GO documents them
+    return [c for c in dict.fromkeys(COMPONENTS.values()) if c in components]
 
 
 class PlayerState:
-    def __init__(self, json, sounds):
+    """Snapshot of the fields we care about in a gamestate"""
+
+    __slots__ = (
+        "valid",
+        "sounds",
+        "steamid",
+        "playerid",
+        "is_local_player",
+        "is_ingame",
+        "play_timeout",
+        "current_round",
+        "flash_opacity",
+        "is_knife_active",
+        "mvps",
+        "phase",
+        "remaining_timeouts",
+        "round_kills",
+        "round_headshots",
+        "total_deaths",
+        "total_kills",
+        "won_round",
+    )
+
+    def __init__(self, gamestate: Optional[Gamestate], sounds):
         self.valid = False
         self.sounds = sounds
-
-        provider = json.get("provider", {})
-        if not provider:
-            # Not ingame
-            return
-
-        player = json.get("player", {})
-        if not player:
-            # Invalid gamestate
-            return
-
-        # Is the GameState tracking local player or spectated player
-        self.steamid = provider["steamid"]
-        self.playerid = player["steamid"]
-        self.is_local_player = self.steamid == self.playerid
-        self.is_ingame = player["activity"] != "menu"
+        self.is_ingame = False
+        self.is_local_player = False
+        self.steamid = None
+        self.playerid = None
+        self.phase = "unknown"
+        self.won_round = False
 
         # NOTE : this is modified in compare()
         self.play_timeout = False
 
-        if self.is_ingame:
-            sounds.playerid = self.playerid
-        else:
-            sounds.playerid = None
+        if gamestate is None:
+            # Not ingame, or invalid gamestate
             return
 
-        try:
-            map = json.get("map", {})
-            round = json.get("round", {})
-            match_stats = player["match_stats"]
-            state = player["state"]
-            self.current_round = map["round"]
-        except KeyError as err:
-            print("Invalid json :")
-            print(err)
-            print(json)
+        # Is the GameState tracking local player or spectated player
+        self.steamid = gamestate.steamid
+        self.playerid = gamestate.playerid
+        self.is_local_player = self.steamid == self.playerid
+        self.is_ingame = not gamestate.in_menu
+        if not self.is_ingame:
             return
 
-        self.flash_opacity = state["flashed"]
-        self.is_knife_active = False
-        for weapon in player["weapons"]:
-            weapon = player["weapons"][weapon]
-            # Taser has no 'type' so we have to check for its name
-            if weapon["name"] == "weapon_taser":
-                self.is_knife_active = weapon["state"] == "active"
-            elif weapon["type"] == "Knife":
-                self.is_knife_active = weapon["state"] == "active"
-        self.mvps = match_stats["mvps"]
-        self.phase = round["phase"] if round else "unknown"
-        self.remaining_timeouts = (
-            map["team_ct"]["timeouts_remaining"] + map["team_t"]["timeouts_remaining"]
-        )
-        self.round_kills = state["round_kills"]
-        self.round_headshots = state["round_killhs"]
-        self.total_deaths = match_stats["deaths"]
-        self.total_kills = match_stats["kills"]
+        self.current_round = gamestate.current_round
+        self.flash_opacity = gamestate.flashed
+        self.is_knife_active = gamestate.knife_active
+        self.mvps = gamestate.mvps
+        self.phase = gamestate.phase
+        self.remaining_timeouts = gamestate.ct_timeouts + gamestate.t_timeouts
+        self.round_kills = gamestate.round_kills
+        self.round_headshots = gamestate.round_killhs
+        self.total_deaths = gamestate.deaths
+        self.total_kills = gamestate.kills
 
         # ------------------------------------------------------------
         # Below, only states that can't be compared to previous states
         # ------------------------------------------------------------
 
-        # Updates only at round end
+        # Updates only at round end. No team means the player has not yet
+        # joined one.
         if self.phase == "over":
-            try:
-                self.won_round = round["win_team"] == player["team"]
-            except KeyError:
-                # Player has not yet joined a team
-                self.won_round = False
-
-        # ------------------------------------------------------------
+            self.won_round = (
+                gamestate.team is not None and gamestate.win_team == gamestate.team
+            )
 
         self.valid = True
 
-    def compare(self, old_state) -> None:
+    def compare(self, old_state, post=None) -> None:
+        """Posts sound events for what changed since old_state.
+
+        post defaults to self.sounds.post, and is called with the categories to try.
+        """
         # Init state without playing sounds
         if not old_state or not old_state.valid:
             return
@@ -108,112 +183,171 @@ class PlayerState:
             self.play_timeout = True
             print("[*] Timeout sound queued for next freezetime")
 
-        # Play timeout music
-        if self.phase == "freezetime" and self.play_timeout:
-            self.sounds.play("Timeout")
-            self.play_timeout = False
-
         # Reset state when switching players (used for MVPs)
         if self.playerid != old_state.playerid:
             print("[*] Different player")
-            return
 
-        # Play round start, win, lose, MVP
-        if self.is_local_player and self.mvps == old_state.mvps + 1:
-            self.sounds.play("MVP")
-        elif self.phase != old_state.phase:
-            if self.phase == "over" and self.mvps == old_state.mvps:
-                self.sounds.play("Round win" if self.won_round else "Round lose")
-            elif self.phase == "live":
-                self.sounds.play("Round start")
-
-        # Don't play player-triggered sounds below this ##########
-        if not self.is_local_player:
+        engine.run(self, old_state, post or self.sounds.post)
+
+
+def feed_key(json) -> str:
+    """Identifies the game client a gamestate comes from : its auth token if
+    its cfg has one, otherwise the steamid of the player running it."""
+    if not isinstance(json, dict):
+        return ""
+    auth = json.get("auth")
+    if isinstance(auth, dict) and auth.get("token"):
+        return str(auth["token"])
+    provider = json.get("provider")
+    if isinstance(provider, dict) and provider.get("steamid"):
+        return str(provider["steamid"])
+    return ""
+
+
+class Feed:
+    """Gamestate of one game client"""
+
+    __slots__ = ("key", "old_state", "audible", "errors", "fingerprint")
+
+    def __init__(self, key: str, audible: bool) -> None:
+        self.key = key
+        self.old_state = None
+        # Muted feeds are still followed, so they are up to date when unmuted
+        self.audible = audible
+        # Validation errors already reported
+        self.errors: Set[str] = set()
+        # Of the last payload that gave a valid state
+        self.fingerprint: Optional[tuple] = None
+
+    def report(self, err: SchemaError) -> None:
+        """Prints a validation error, the first time this feed sends it."""
+        message = str(err)
+        if message in self.errors:
             return
-        ##########################################################
-
-        # Lost kills - either teamkilled or suicided
-        if self.total_kills < old_state.total_kills:
-            if self.total_deaths == old_state.total_deaths + 1:
-                self.sounds.play("Suicide")
-            elif self.total_deaths == old_state.total_deaths:
-                self.sounds.play("Teamkill")
-        # Didn't suicide or teamkill -> check if player just died
-        elif self.total_deaths == old_state.total_deaths + 1:
-            self.sounds.play("Death")
-
-        # Player got flashed
-        if self.flash_opacity > 150 and self.flash_opacity > old_state.flash_opacity:
-            self.sounds.play("Flashed")
-
-        # Player killed someone
-        if self.round_kills == old_state.round_kills + 1:
-            # Kill with knife equipped
-            if self.is_knife_active:
-                self.sounds.play("Unusual kill")
-            # Kill with weapon equipped
-            else:
-                # Prefer playing "Headshot" over "x kills"
-                prefer_headshots = config.config["Sounds"].getboolean(  # type: ignore
-                    "PreferHeadshots", False
-                )
-
-                if self.round_headshots == old_state.round_headshots + 1:
-                    if prefer_headshots:
-                        self.sounds.play("Headshot")
-                    else:
-                        self.sounds.play(
-                            f"{self.round_kills} kills"
-                        ) or self.sounds.play("Headshot")
-                else:
-                    self.sounds.play(f"{self.round_kills} kills")
-        # Player killed multiple players
-        elif self.round_kills > old_state.round_kills:
-            self.sounds.play("Collateral")
+        self.errors.add(message)
+        print(f"[!] Invalid gamestate from feed '{self.key}' : {message}")
 
 
 class CSGOState:
-    """Follows the CSGO state via gamestate integration"""
+    """Follows the CSGO state via gamestate integration.
+
+    Several game clients can post to the same server (e.g. LAN or observer
+    setups) : each feed gets its own state, and the sounds of every audible
+    feed are mixed together.
+    """
 
-    def __init__(self, client):
-        self.lock = Lock()
+    def __init__(self, client, listen: bool = True):
+        # Latest PlayerState, of whichever feed updated last. It is never modified
+        # once published here, so readers only need to read this reference once,
+        # without locking.
         self.old_state = None
         self.client = client
+        # Dict[feed key:Feed]
+        self.feeds: Dict[str, Feed] = {}
+        config.settings.subscribe("feeds_listen", self.route)
+        # Payloads with the fingerprint of their feed's last one can't play a
+        # sound : heartbeats, and updates to fields nothing reads (health, ammo,
+        # money...). They are neither decoded nor compared.
+        self.fingerprint = gsi.fingerprinter(
+            sorted(set(a for field in used_fields() for a in ATTRIBUTES[field]))
+        )
+
+        # Runs on the event loop created in main()
+        self.server = None
+        if listen:
+            asyncio.ensure_future(self.serve())
+
+    async def serve(self):
+        recorder = None
+        record_path = config.settings.record_path
+        if record_path:
+            recorder = Recorder(record_path)
+        routes = {
+            "/metrics": metrics.to_json,
+            "/buffers": lambda: json.dumps(
+                self.client.sounds.buffers.stats(), indent=2
+            ).encode(),
+        }
+        for kind in KINDS:
+            routes["/profile/" + kind] = lambda kind=kind: profiler.endpoint(
+                [kind], config.settings.profile_seconds, config.settings.profile_dir
+            )
+        self.server = await server.serve(
+            self,
+            host=config.settings.server_host,
+            port=config.settings.server_port,
+            recorder=recorder,
+            routes=routes,
+        )
+
+    @staticmethod
+    def audible(key: str) -> bool:
+        listen = config.settings.feeds_listen
+        return not listen or key in [k.strip() for k in listen.split(",")]
 
-        server = HTTPServer(("127.0.0.1", 3000), PostHandler)
-        server.RequestHandlerClass.state = self
-        Thread(target=server.serve_forever, daemon=True).start()
+    def route(self, _=None) -> None:
+        """Mutes the feeds that are not listened to."""
+        for feed in list(self.feeds.values()):
+            feed.audible = self.audible(feed.key)
 
     def is_ingame(self):
-        return self.old_state is not None and self.old_state.is_ingame is True
+        state = self.old_state
+        return state is not None and state.is_ingame is True
 
     def is_alive(self):
-        with self.lock:
-            if not self.is_ingame():
-                return False
-            if self.old_state.phase != "live":
-                return False
-            if self.old_state.steamid != self.old_state.playerid:
-                return False
+        state = self.old_state
+        if state is None or state.is_ingame is not True:
+            return False
+        if state.phase != "live":
+            return False
+        if state.steamid != state.playerid:
+            return False
         return True
 
-    def update(self, json):
-        """Update the entire game state"""
-        with self.lock:
-            newstate = PlayerState(json, self.client.sounds)
-            newstate.compare(self.old_state)
-            self.old_state = newstate
-
-
-class PostHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        content_len = int(self.headers["Content-Length"])
-        body = self.rfile.read(content_len)
-        self.send_response(200)
-        self.end_headers()
-        self.state.update(json.loads(body))
-        return
-
-    def log_message(self, format, *args):
-        # Do not spam the console with POSTs
-        return
+    def update_raw(self, body: bytes, received=None):
+        """Update the entire game state from a raw POST body"""
+        self.update(gsi.loads(body), received)
+
+    def update(self, json, received=None):
+        """Update the entire game state.
+
+        received is the time.monotonic() the update arrived at, for latency metrics.
+        """
+        sounds = self.client.sounds
+        key = feed_key(json)
+        feed = self.feeds.get(key)
+        if feed is None:
+            feed = self.feeds[key] = Feed(key, self.audible(key))
+            print(f"[*] New gamestate feed '{key}' ({len(self.feeds)} total)")
+
+        fingerprint = self.fingerprint(json)
+        if fingerprint is not None and fingerprint == feed.fingerprint:
+            metrics.count("duplicate")
+            self.old_state = feed.old_state
+            return
+
+        old_state = feed.old_state
+        start = time.monotonic()
+        try:
+            gamestate = gsi.decode(json)
+        except SchemaError as err:
+            feed.report(err)
+            gamestate = None
+        newstate = PlayerState(gamestate, sounds)
+        built = time.monotonic()
+
+        def post(sound_names):
+            if feed.audible:
+                sounds.post(sound_names, received)
+
+        newstate.compare(old_state, post)
+        metrics.record("build", built - start)
+        metrics.record("compare", time.monotonic() - built)
+        if feed.audible:
+            for category in prefetches(newstate, old_state):
+                sounds.prefetch(category)
+        # Publish the new snapshot
+        feed.fingerprint = fingerprint if newstate.valid else None
+        feed.old_state = newstate
+        self.old_state = newstate
+
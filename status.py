@@ -0,0 +1,110 @@
+"""Where status messages go, and how often"""
+import asyncio
+import logging
+import time
+from threading import Lock
+from typing import Callable, Optional
+
+# Status updates shown per second, at most
+STATUS_FPS = 20
+
+
+class ConsoleStatus:
+    """Prints status messages, skipping repeats."""
+
+    def __init__(self) -> None:
+        self.last = None
+
+    def __call__(self, text: str) -> None:
+        if text == self.last:
+            return
+        self.last = text
+        print(f"[*] {text}")
+
+
+class LogStatus:
+    """Sends status messages to the logging module."""
+
+    def __init__(self, logger: str = "csgo-custom-sounds") -> None:
+        self.logger = logging.getLogger(logger)
+
+    def __call__(self, text: str) -> None:
+        self.logger.info(text)
+
+
+class StatusScheduler:
+    """Shows status messages from any thread, at most STATUS_FPS times a second.
+
+    Messages are shown from the event loop, so show() may touch the GUI. Only
+    the latest message is shown : the ones it replaced never reach the GUI
+    event queue. Repeats are skipped.
+    """
+
+    def __init__(
+        self,
+        show: Callable[[str], None],
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        fps: float = STATUS_FPS,
+    ) -> None:
+        self.show = show
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.interval = 1.0 / fps
+        self.lock = Lock()
+        # Latest message not shown yet
+        self.pending: Optional[str] = None
+        self.scheduled = False
+        self.paused = False
+        self.shown: Optional[str] = None
+        self.last_flush = 0.0
+
+    def __call__(self, text: str) -> None:
+        with self.lock:
+            self.pending = text
+            if self.scheduled or self.paused:
+                return
+            self.scheduled = True
+        self.wake()
+
+    def wake(self) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.schedule)
+        except RuntimeError:
+            # Loop closed, we are exiting
+            pass
+
+    def schedule(self) -> None:
+        delay = self.last_flush + self.interval - time.monotonic()
+        if delay > 0:
+            self.loop.call_later(delay, self.flush)
+        else:
+            self.flush()
+
+    def flush(self) -> None:
+        """Shows the latest message, from the event loop."""
+        with self.lock:
+            self.scheduled = False
+            if self.paused:
+                return
+            text = self.pending
+            self.pending = None
+        self.last_flush = time.monotonic()
+        if text is None or text == self.shown:
+            return
+        self.shown = text
+        self.show(text)
+
+    def pause(self) -> None:
+        """Holds messages back, e.g. while the window is minimized."""
+        with self.lock:
+            self.paused = True
+
+    def resume(self) -> None:
+        """Shows the latest message held back, if any."""
+        with self.lock:
+            self.paused = False
+            # The last message shown may have been hidden meanwhile
+            self.shown = None
+            if self.pending is None or self.scheduled:
+                return
+            self.scheduled = True
+        self.wake()
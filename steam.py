@@ -0,0 +1,224 @@
+"""Finds the CS:GO install directory and installs the gamestate integration cfg"""
+import json
+import os
+import queue
+import secrets
+import time
+from pathlib import Path
+from threading import Thread
+from typing import List, Optional, Sequence, Tuple
+
+import config
+import steamfiles
+from state import subscriptions
+from timeline import startup
+
+CACHE_FILE = os.path.join("cache", "steam.json")
+CFG_FILE = "gamestate_integration_ccs.cfg"
+
+# Library drives can be network shares or spun-down disks
+PROBE_TIMEOUT = 5.0
+
+
+def get_steam_path() -> str:
+    if os.name == "nt":  # windows
+        import winreg  # type: ignore
+
+        key = winreg.OpenKey(
+            winreg.HKEY_LOCAL_MACHINE,
+            "SOFTWARE\\WOW6432Node\\Valve\\Steam",
+            0,
+            winreg.KEY_READ,
+        )
+        value, regtype = winreg.QueryValueEx(key, "InstallPath")
+        winreg.CloseKey(key)
+        return value
+    else:
+        return os.path.join(Path.home(), ".steam/root")
+
+
+def mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load_cache(steamapps_folder: str) -> Optional[str]:
+    """Returns the cached installdir, if neither Steam file changed since."""
+    try:
+        with open(CACHE_FILE) as infile:
+            cache = json.load(infile)
+    except (OSError, ValueError):
+        return None
+
+    libraryfolders = os.path.join(steamapps_folder, "libraryfolders.vdf")
+    if cache.get("steamapps") != steamapps_folder:
+        return None
+    if cache.get("libraryfolders_mtime") != mtime(libraryfolders):
+        return None
+    if cache.get("appmanifest_mtime") != mtime(cache.get("appmanifest", "")):
+        return None
+    return cache.get("installdir")
+
+
+def save_cache(steamapps_folder: str, appmanifest: str, installdir: str) -> None:
+    libraryfolders = os.path.join(steamapps_folder, "libraryfolders.vdf")
+    cache = {
+        "steamapps": steamapps_folder,
+        "libraryfolders_mtime": mtime(libraryfolders),
+        "appmanifest": appmanifest,
+        "appmanifest_mtime": mtime(appmanifest),
+        "installdir": installdir,
+    }
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        with open(CACHE_FILE, "w") as outfile:
+            json.dump(cache, outfile)
+    except OSError as err:
+        print(f"[!] Could not cache CS:GO path : {err}")
+
+
+def get_library_folders(steamapps_folder: str) -> List[str]:
+    """Returns every steamapps folder, the main one first."""
+    with open(os.path.join(steamapps_folder, "libraryfolders.vdf")) as infile:
+        libraryfolders = steamfiles.load(infile)
+    # Older Steam versions capitalize the root section
+    libraries = libraryfolders.get("LibraryFolders") or libraryfolders.get(
+        "libraryfolders", {}
+    )
+
+    folders = [steamapps_folder]
+    i = 1
+    while str(i) in libraries:
+        library = libraries[str(i)]
+        # Newer Steam versions store a section per library instead of a path
+        if isinstance(library, dict):
+            library = library.get("path", "")
+        steamapps = os.path.join(library, "steamapps")
+        print(f"Found steamapps folder {steamapps}")
+        if steamapps not in folders:
+            folders.append(steamapps)
+        i = i + 1
+    return folders
+
+
+def probe(folder: str) -> Optional[Tuple[str, str]]:
+    """Returns (appmanifest, installdir) if CS:GO is in this library."""
+    appmanifest = os.path.join(folder, "appmanifest_730.acf")
+    try:
+        with open(appmanifest) as infile:
+            manifest = infile.read()
+    except OSError:
+        return None
+    # Stops parsing as soon as installdir is found
+    installdir = steamfiles.get(manifest, "AppState", "installdir")
+    if installdir is None:
+        return None
+    return appmanifest, os.path.join(folder, "common", installdir)
+
+
+def first_found(folders: List[str], done: dict) -> Optional[Tuple[str, str]]:
+    """Returns the first library with CS:GO, once every library before it answered."""
+    for folder in folders:
+        if folder not in done:
+            return None
+        if done[folder] is not None:
+            return done[folder]
+    return None
+
+
+def get_csgo_path(steamapps_folder):
+    installdir = load_cache(steamapps_folder)
+    if installdir is not None:
+        print(f"Cached installdir: {installdir}")
+        return installdir
+
+    # Probe every library at once, each in a daemon thread so a hung drive can't
+    # keep the app from exiting.
+    folders = get_library_folders(steamapps_folder)
+    results: queue.Queue = queue.Queue()
+    for folder in folders:
+        Thread(
+            target=lambda f: results.put((f, probe(f))), args=(folder,), daemon=True
+        ).start()
+
+    done = {}
+    deadline = time.monotonic() + PROBE_TIMEOUT
+    try:
+        while len(done) < len(folders):
+            folder, result = results.get(timeout=max(deadline - time.monotonic(), 0))
+            done[folder] = result
+            if first_found(folders, done) is not None:
+                break
+    except queue.Empty:
+        print(f"[!] Some Steam libraries did not answer within {PROBE_TIMEOUT}s")
+
+    for folder in folders:
+        if done.get(folder) is not None:
+            appmanifest, installdir = done[folder]
+            print(f"Valid installdir found: {installdir}")
+            save_cache(steamapps_folder, appmanifest, installdir)
+            return installdir
+
+    print("CS:GO not found :/")
+
+
+def render_gsi_config(uri: str, token: str, components: Sequence[str]) -> str:
+    """Returns a gamestate integration cfg asking for components only."""
+    lines = [
+        '"CSGO Custom Sounds"',
+        "{",
+        f'  "uri"       "{uri}"',
+        '  "buffer"    "0.0"',
+        '  "throttle"  "0.0"',
+        '  "heartbeat" "60.0"',
+        '  "auth"',
+        "  {",
+        f'    "token"   "{token}"',
+        "  }",
+        '  "data"',
+        "  {",
+    ]
+    for component in components:
+        lines.append("    " + f'"{component}"'.ljust(22) + '"1"')
+    lines.extend(["  }", "}", ""])
+    return "\n".join(lines)
+
+
+def gsi_config() -> str:
+    """The cfg for this install : our address, our token, and only the
+    components the event rules use."""
+    token = config.settings.auth_token
+    if not token:
+        token = secrets.token_hex(16)
+        config.settings.set("auth_token", token)
+
+    host = config.settings.server_host
+    if host in ("", "0.0.0.0", "::"):
+        host = "127.0.0.1"
+    uri = f"http://{host}:{config.settings.server_port}"
+    return render_gsi_config(uri, token, subscriptions())
+
+
+def install_gsi_config():
+    """Ensures gamestate integration cfg is in csgo's cfg directory"""
+    try:
+        csgo_dir = get_csgo_path(os.path.join(get_steam_path(), "steamapps"))
+        startup.mark("steam discovery")
+        if csgo_dir is None:
+            return
+
+        installed = os.path.join(csgo_dir, "csgo", "cfg", CFG_FILE)
+        content = gsi_config()
+        try:
+            with open(installed) as infile:
+                if infile.read() == content:
+                    return
+        except FileNotFoundError:
+            pass
+        with open(installed, "w") as outfile:
+            outfile.write(content)
+        startup.mark("gamestate integration cfg installed")
+    except OSError as err:
+        print(f"[!] Could not install gamestate integration cfg : {err}")
@@ -1,8 +1,113 @@
-"""Parses steam ACF files.
+"""Parses steam ACF/VDF files.
 
-Straight up ripped from https://github.com/leovp/steamfiles.
+Originally ripped from https://github.com/leovp/steamfiles.
 (I was having issues building with cx_Freeze)
+
+The text is tokenized in a single pass, so quoted keys and values may contain
+spaces, braces and escaped quotes. events() lets callers stop as soon as they
+found what they need, and loads_lazy() only parses sub-sections on access.
 """
+import re
+from collections.abc import Mapping
+from typing import Iterator, Optional, Tuple
+
+START = "start"
+VALUE = "value"
+END = "end"
+
+# Quoted string (with escapes), brace, comment or unquoted token. Leading
+# whitespace is part of the match, which is much faster than letting the regex
+# engine retry at every whitespace character.
+_TOKEN = re.compile(r'\s*("[^"\\]*(?:\\.[^"\\]*)*"|[{}]|//[^\n]*|[^\s{}"]+)')
+
+
+def _unescape(token: str) -> str:
+    if "\\n" not in token and "\\t" not in token and '\\"' not in token:
+        # Only escaped backslashes, e.g. windows paths
+        return token.replace("\\\\", "\\")
+    # Split on escaped backslashes first, so any backslash left starts an escape
+    parts = token.split("\\\\")
+    for i, part in enumerate(parts):
+        if "\\" in part:
+            parts[i] = part.replace('\\"', '"').replace("\\n", "\n").replace("\\t", "\t")
+    return "\\".join(parts)
+
+
+def _string(token: str) -> Optional[str]:
+    """Returns the string a token stands for, or None for comments/conditionals."""
+    first = token[0]
+    if first == '"':
+        token = token[1:-1]
+        return _unescape(token) if "\\" in token else token
+    if first == "/" and token.startswith("//"):
+        return None
+    if first == "[" and token.endswith("]"):
+        # Platform conditional, e.g. [$WIN32]
+        return None
+    return token
+
+
+def _check_type(data) -> None:
+    if not isinstance(data, str):
+        raise TypeError("can only load a str as an ACF but got " + type(data).__name__)
+
+
+def _events(data: str, pos: int = 0) -> Iterator[Tuple[str, str, Optional[str]]]:
+    """Yields (event, key, value) starting at pos."""
+    key = None
+    for match in _TOKEN.finditer(data, pos):
+        token = match.group(1)
+        if token == "{":
+            yield START, key if key is not None else "", None
+            key = None
+        elif token == "}":
+            yield END, "", None
+            key = None
+        else:
+            string = _string(token)
+            if string is None:
+                continue
+            if key is None:
+                key = string
+            else:
+                yield VALUE, key, string
+                key = None
+
+
+def events(data: str) -> Iterator[Tuple[str, str, Optional[str]]]:
+    """
+    Streams ACF content as (event, key, value) tuples.
+    :param data: An UTF-8 encoded content of an ACF file.
+    :return: START (key, None) when a section opens, VALUE (key, value) for
+    key-value pairs and END ("", None) when a section closes.
+    """
+    _check_type(data)
+    return _events(data)
+
+
+def get(data: str, *path: str) -> Optional[str]:
+    """
+    Returns a single value from ACF content, without parsing the rest of it.
+    :param data: An UTF-8 encoded content of an ACF file.
+    :param path: Section names followed by the key, e.g. ("AppState", "installdir").
+    :return: The value, or None if it isn't there.
+    """
+    _check_type(data)
+    depth = 0
+    matched = 0
+    for event, key, value in _events(data):
+        if event == START:
+            if matched == depth and matched < len(path) - 1 and key == path[matched]:
+                matched = matched + 1
+            depth = depth + 1
+        elif event == END:
+            depth = depth - 1
+            if depth < matched:
+                # Left the section we were looking into
+                return None
+        elif matched == depth == len(path) - 1 and key == path[-1]:
+            return value
+    return None
 
 
 def loads(data, wrapper=dict):
@@ -12,33 +117,90 @@ def loads(data, wrapper=dict):
     :param wrapper: A wrapping object for key-value pairs.
     :return: An Ordered Dictionary with ACF data.
     """
-    if not isinstance(data, str):
-        raise TypeError("can only load a str as an ACF but got " + type(data).__name__)
+    _check_type(data)
 
     parsed = wrapper()
+    stack = [parsed]
     current_section = parsed
-    sections = []
-
-    lines = (line.strip() for line in data.splitlines())
-
-    for line in lines:
-        try:
-            key, value = line.split(None, 1)
-            key = key.replace('"', "").lstrip()
-            value = value.replace('"', "").rstrip()
-        except ValueError:
-            if line == "{":
-                # Initialize the last added section.
-                current_section = _prepare_subsection(parsed, sections, wrapper)
-            elif line == "}":
-                # Remove the last section from the queue.
-                sections.pop()
+    key = None
+
+    # Fast path : nearly every line is a brace, a "key" or a "key" "value" pair,
+    # which string methods split much faster than the tokenizer. Any other line
+    # (comments, conditionals, escaped quotes...) sends the whole content
+    # through the tokenizer instead.
+    for line in data.splitlines():
+        line = line.strip()
+        if line[:1] == '"' and line[-1] == '"':
+            parts = line.split('"')
+            escaped = "\\" in line
+            if escaped and '\\"' in line:
+                return _loads_tokens(data, wrapper)
+            if len(parts) == 5 and key is None and parts[2].isspace():
+                pair_key, value = parts[1], parts[3]
+                if escaped:
+                    if "\\" in pair_key:
+                        pair_key = _unescape(pair_key)
+                    if "\\" in value:
+                        value = _unescape(value)
+                current_section[pair_key] = value
+            elif len(parts) == 3:
+                string = _unescape(parts[1]) if escaped else parts[1]
+                if key is None:
+                    key = string
+                else:
+                    # Value on its own line
+                    current_section[key] = string
+                    key = None
             else:
-                # Add a new section to the queue.
-                sections.append(line.replace('"', ""))
+                return _loads_tokens(data, wrapper)
+        elif line == "{":
+            section = wrapper()
+            current_section[key if key is not None else ""] = section
+            stack.append(section)
+            current_section = section
+            key = None
+        elif line == "}":
+            if len(stack) > 1:
+                stack.pop()
+                current_section = stack[-1]
+            key = None
+        elif line:
+            return _loads_tokens(data, wrapper)
+
+    return parsed
+
+
+def _loads_tokens(data: str, wrapper=dict):
+    """loads(), for any content."""
+    parsed = wrapper()
+    stack = [parsed]
+    current_section = parsed
+    key = None
+
+    # Same as iterating over events(), inlined since this is the hot path
+    for token in _TOKEN.findall(data):
+        if token == "{":
+            section = wrapper()
+            current_section[key if key is not None else ""] = section
+            stack.append(section)
+            current_section = section
+            key = None
+            continue
+        elif token == "}":
+            if len(stack) > 1:
+                stack.pop()
+                current_section = stack[-1]
+            key = None
             continue
 
-        current_section[key] = value
+        string = _string(token)
+        if string is None:
+            continue
+        if key is None:
+            key = string
+        else:
+            current_section[key] = string
+            key = None
 
     return parsed
 
@@ -53,17 +215,74 @@ def load(fp, wrapper=dict):
     return loads(fp.read(), wrapper=wrapper)
 
 
-def _prepare_subsection(data, sections, wrapper):
+def _skip_section(data: str, pos: int) -> int:
+    """Returns the position right after the section that starts at pos."""
+    depth = 1
+    for match in _TOKEN.finditer(data, pos):
+        token = match.group(1)
+        if token == "{":
+            depth = depth + 1
+        elif token == "}":
+            depth = depth - 1
+            if depth == 0:
+                return match.end()
+    return len(data)
+
+
+class LazySection(Mapping):
+    """A read-only section whose sub-sections are parsed on first access."""
+
+    def __init__(self, data: str, pos: int = 0, root: bool = True) -> None:
+        self._data = data
+        # Values are either str, LazySection or the offset of an unparsed section
+        self._items: dict = {}
+
+        key = None
+        while True:
+            for match in _TOKEN.finditer(data, pos):
+                token = match.group(1)
+                if token == "{":
+                    self._items[key if key is not None else ""] = match.end()
+                    key = None
+                    # Jump over the sub-section, it will be parsed when needed
+                    pos = _skip_section(data, match.end())
+                    break
+                elif token == "}":
+                    if not root:
+                        return
+                    key = None
+                    continue
+
+                string = _string(token)
+                if string is None:
+                    continue
+                if key is None:
+                    key = string
+                else:
+                    self._items[key] = string
+                    key = None
+            else:
+                return
+
+    def __getitem__(self, key):
+        value = self._items[key]
+        if isinstance(value, int):
+            value = LazySection(self._data, value, root=False)
+            self._items[key] = value
+        return value
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def loads_lazy(data) -> LazySection:
     """
-    Creates a subsection ready to be filled.
-    :param data: Semi-parsed dictionary.
-    :param sections: A list of sections.
-    :param wrapper: A wrapping object for key-value pairs.
-    :return: A newly created subsection.
+    Loads ACF content, deferring the parsing of sub-sections until they are used.
+    :param data: An UTF-8 encoded content of an ACF file.
+    :return: A read-only mapping with ACF data.
     """
-    current = data
-    for i in sections[:-1]:
-        current = current[i]
-
-    current[sections[-1]] = wrapper()
-    return current[sections[-1]]
+    _check_type(data)
+    return LazySection(data)
@@ -0,0 +1,40 @@
+"""Startup timeline, to keep an eye on how long the app takes to be ready"""
+import time
+from threading import Lock
+from typing import List, Tuple
+
+# Imported first by main.py, so this is as close to process start as we get
+START = time.perf_counter()
+
+
+class Timeline:
+    """Records named phases, in milliseconds since START."""
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.marks: List[Tuple[str, float]] = []
+        self.reported = False
+
+    def mark(self, phase: str) -> None:
+        """Marks the end of a phase. Safe to call from any thread."""
+        with self.lock:
+            if self.reported:
+                return
+            self.marks.append((phase, (time.perf_counter() - START) * 1000.0))
+
+    def report(self) -> None:
+        """Prints the timeline, once."""
+        with self.lock:
+            if self.reported:
+                return
+            self.reported = True
+            marks = sorted(self.marks, key=lambda mark: mark[1])
+
+        print("[*] Startup timeline :")
+        previous = 0.0
+        for phase, elapsed in marks:
+            print(f"    {elapsed:8.1f} ms  (+{elapsed - previous:7.1f} ms)  {phase}")
+            previous = elapsed
+
+
+startup = Timeline()
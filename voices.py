@@ -0,0 +1,119 @@
+"""Fixed pool of OpenAL sources"""
+import asyncio
+import time
+from openal import AL_PLAYING, Buffer, Source  # type: ignore
+from typing import Callable, List, Optional
+
+# Higher priority sounds can interrupt lower (or equal) priority ones when every
+# voice is busy. Unknown categories get DEFAULT_PRIORITY.
+PRIORITIES = {
+    "5 kills": 10,
+    "4 kills": 9,
+    "3 kills": 8,
+    "Collateral": 8,
+    "2 kills": 7,
+    "Unusual kill": 7,
+    "MVP": 6,
+    "Round win": 5,
+    "Round lose": 5,
+    "Timeout": 5,
+    "Headshot": 4,
+    "Teamkill": 4,
+    "Suicide": 4,
+    "Death": 3,
+    "Flashed": 2,
+    "Round start": 1,
+}
+DEFAULT_PRIORITY = 3
+
+
+class Voice:
+    __slots__ = ("source", "priority", "started", "buffer")
+
+    def __init__(self, source: Source) -> None:
+        self.source = source
+        self.priority = 0
+        self.started = 0.0
+        self.buffer: Optional[Buffer] = None
+
+
+class VoicePool:
+    """Plays buffers on a fixed number of sources, created once at startup.
+
+    A single reaper task returns finished voices to the pool, instead of one
+    polling coroutine per playing sound.
+    """
+
+    def __init__(self, size: int, reap_interval: float = 0.05) -> None:
+        self.free: List[Voice] = [Voice(Source()) for _ in range(max(size, 1))]
+        self.playing: List[Voice] = []
+        self.reap_interval = reap_interval
+        # Called when the last playing voice finishes
+        self.on_idle: Optional[Callable[[], None]] = None
+        self.wakeup = asyncio.Event()
+        self.reaper = asyncio.ensure_future(self.reap())
+
+    def acquire(self, priority: int) -> Optional[Voice]:
+        """Returns a free voice, or steals the least important playing one."""
+        if self.free:
+            return self.free.pop()
+
+        victim = None
+        for voice in self.playing:
+            if voice.priority > priority:
+                continue
+            if (
+                victim is None
+                or voice.priority < victim.priority
+                or (voice.priority == victim.priority and voice.started < victim.started)
+            ):
+                victim = voice
+        if victim is None:
+            return None
+
+        self.playing.remove(victim)
+        victim.source.stop()
+        return victim
+
+    def play(self, buffer: Buffer, gain: float, priority: int) -> bool:
+        """Starts playing a buffer. Returns False if every voice is more important."""
+        voice = self.acquire(priority)
+        if voice is None:
+            return False
+
+        voice.priority = priority
+        voice.started = time.monotonic()
+        voice.buffer = buffer
+        voice.source.set_buffer(buffer)
+        voice.source.set_gain(gain)
+        voice.source.play()
+        self.playing.append(voice)
+        self.wakeup.set()
+        return True
+
+    def in_use(self, buffer: Buffer) -> bool:
+        """True if the buffer is playing, safe to call from any thread."""
+        return any(voice.buffer is buffer for voice in list(self.playing))
+
+    async def reap(self) -> None:
+        """Returns voices to the pool as soon as they finish playing."""
+        while True:
+            if not self.playing:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            await asyncio.sleep(self.reap_interval)
+            self.collect()
+
+    def collect(self) -> None:
+        """Moves finished voices back to the free list."""
+        still_playing = []
+        for voice in self.playing:
+            if voice.source.get_state() == AL_PLAYING:
+                still_playing.append(voice)
+            else:
+                voice.buffer = None
+                self.free.append(voice)
+        was_playing = bool(self.playing)
+        self.playing = still_playing
+        if was_playing and not still_playing and self.on_idle is not None:
+            self.on_idle()